@@ -1,15 +1,42 @@
+import base64
+import BaseHTTPServer
+import contextlib
 import datetime
+import gzip
+import httplib
+import json
 import logging
+import math
+import mmap
+import os
+import Queue
 import re
+import socket
+import SocketServer
+import sqlite3
+import struct
 import sys
+import threading
+import time
 import urllib
 import urllib2
+import urlparse
 import uuid
+import zipfile
+import zlib
+from collections import deque, OrderedDict
 from xml.dom import minidom
+from xml.parsers.expat import ExpatError
 
-# Smartly import hashlib and fall back on md5
-try: from hashlib import md5
-except ImportError: from md5 import md5
+# Smartly import hashlib and fall back on md5 and sha
+try: from hashlib import md5, sha1
+except ImportError:
+    from md5 import md5
+    from sha import sha as sha1
+
+# NumPy is only needed for RegistrationResultAnalytics
+try: import numpy
+except ImportError: numpy = None
 
 
 def make_utf8(dictionary):
@@ -30,17 +57,93 @@ def make_utf8(dictionary):
     return result
 
 
+_deadline_local = threading.local()
+
+
+@contextlib.contextmanager
+def service_deadline(seconds):
+    """
+    Context manager that limits the total time of all web service calls made
+    by the current thread inside the with block. Calls that would run past
+    the deadline raise ScormCloudTimeoutError. Nested deadlines can only
+    shorten the time budget, never extend it.
+
+    Arguments:
+    seconds -- the time budget, in seconds
+    """
+    outer = getattr(_deadline_local, 'deadline', None)
+    _deadline_local.deadline = get_deadline(seconds)
+    try:
+        yield
+    finally:
+        _deadline_local.deadline = outer
+
+
+def get_deadline(timeout=None):
+    """
+    Returns the deadline (as returned by time.time) for a call with the
+    given timeout, taking the enclosing service_deadline into account, or
+    None if the call has no deadline.
+
+    Arguments:
+    timeout -- (optional) the time budget for the call, in seconds
+    """
+    deadline = getattr(_deadline_local, 'deadline', None)
+    if timeout is not None:
+        calldeadline = time.time() + timeout
+        if deadline is None or calldeadline < deadline:
+            deadline = calldeadline
+    return deadline
+
+
+def get_remaining_time(deadline):
+    """
+    Returns the number of seconds left until the deadline, or None if there
+    is no deadline.
+    """
+    if deadline is None:
+        return None
+    return max(deadline - time.time(), 0)
+
+
+def check_deadline(deadline, what):
+    """
+    Raises ScormCloudTimeoutError if the deadline has passed.
+    """
+    if deadline is not None and time.time() >= deadline:
+        raise ScormCloudTimeoutError('Deadline exceeded for %s' % what)
+
+
 class Configuration(object):
     """
     Stores the configuration elements required by the API.
     """
 
     def __init__(self, appid, secret, 
-                 serviceurl, origin='rusticisoftware.pythonlibrary.2.0.0'):
+                 serviceurl, origin='rusticisoftware.pythonlibrary.2.0.0',
+                 timeout=None):
+        """
+        Arguments:
+        appid -- the AppID for the application defined in the SCORM Cloud
+            account
+        secret -- the secret key for the application
+        serviceurl -- the service URL for the SCORM Cloud web service, or a
+            list of equivalent service URLs (regional endpoints or proxies)
+            to be used with an EndpointRouter. The first URL is the default
+        origin -- the origin string for the application software using the
+            API/Python client library
+        timeout -- (optional) the default time budget, in seconds, for each
+            web service call
+        """
         self.appid = appid
         self.secret = secret
-        self.serviceurl = serviceurl
+        if isinstance(serviceurl, basestring):
+            self.serviceurls = [serviceurl]
+        else:
+            self.serviceurls = list(serviceurl)
+        self.serviceurl = self.serviceurls[0]
         self.origin = origin;
+        self.timeout = timeout
 
     def __repr__(self):
         return 'Configuration for AppID %s from origin %s' % (
@@ -52,9 +155,21 @@ class ScormCloudService(object):
     service areas, like the RegistrationService.
     """
 
-    def __init__(self, configuration):
+    def __init__(self, configuration, transport=None):
         self.config = configuration
+        self.transport = transport
+        if self.transport is None:
+            self.transport = UrllibTransport()
+        self.limiter = None
+        self.course_cache = None
+        self.asset_cache = None
+        self.registration_index = None
+        self.router = None
         self.__handler_cache = {}
+        # Per-course attribute snapshots for update_attributes(diff=True)
+        # when there is no course_cache.
+        self._course_attributes = {}
+        self._course_attributes_lock = threading.Lock()
         
     @classmethod
     def withconfig(cls, config):
@@ -121,12 +236,12 @@ class ScormCloudService(object):
         """
         return ServiceRequest(self)
 
-    def make_call(self, method):
+    def make_call(self, method, serviceurl=None):
         """
         Convenience method to create and call a simple ServiceRequest (no
         parameters).
         """
-        return self.request().call_service(method)
+        return self.request().call_service(method, serviceurl)
 
 class DebugService(object):
     """
@@ -137,23 +252,32 @@ class DebugService(object):
     def __init__(self, service):
         self.service = service
 
-    def ping(self):
+    def ping(self, serviceurl=None):
         """
         A simple ping that checks the connection to the SCORM Cloud.
+
+        Arguments:
+        serviceurl -- (optional) the service URL to ping instead of the
+            configured one
         """
         try:
-            xmldoc = self.service.make_call('rustici.debug.ping')
+            xmldoc = self.service.make_call('rustici.debug.ping', serviceurl)
             return xmldoc.documentElement.attributes['stat'].value == 'ok'
         except Exception, ex:
             return False
     
-    def authping(self):
+    def authping(self, serviceurl=None):
         """
         An authenticated ping that checks the connection to the SCORM Cloud
         and verifies the configured credentials.
+
+        Arguments:
+        serviceurl -- (optional) the service URL to ping instead of the
+            configured one
         """
         try:
-            xmldoc = self.service.make_call('rustici.debug.authPing')
+            xmldoc = self.service.make_call('rustici.debug.authPing',
+                                            serviceurl)
             return xmldoc.documentElement.attributes['stat'].value == 'ok'
         except Exception, ex:
             return False
@@ -201,6 +325,30 @@ class UploadService(object):
         else:
             return None
         
+    def upload_file(self, path, token=None):
+        """
+        Uploads a file to the SCORM Cloud and returns its location on the
+        server, which can be passed to CourseService.import_uploaded_course
+        and delete_file.
+
+        Arguments:
+        path -- the path to the local file to upload
+        token -- (optional) the UploadToken to use. If not provided, a new
+            token is retrieved
+        """
+        if token is None:
+            token = self.get_upload_token()
+            if token is None:
+                raise ScormCloudError('Could not retrieve an upload token.')
+        request = self.service.request()
+        request.parameters['tokenid'] = token.tokenid
+        request.file_ = path
+        xmldoc = request.call_service('rustici.upload.uploadFile')
+        locationNodes = xmldoc.getElementsByTagName('location')
+        if locationNodes.length == 0:
+            raise ScormCloudError('Upload of %s returned no location.' % path)
+        return locationNodes[0].childNodes[0].nodeValue
+
     def delete_file(self, location):
         """
         Deletes the specified file.
@@ -235,8 +383,51 @@ class CourseService(object):
         request.parameters['path'] = path
         result = request.call_service('rustici.course.importCourse')
         ir = ImportResult.list_from_result(result)
+        if self.service.course_cache is not None:
+            self.service.course_cache.invalidate(courseid)
+        if self.service.asset_cache is not None:
+            self.service.asset_cache.invalidate(courseid)
+        self._drop_attribute_snapshot(courseid)
         return ir
     
+    def import_course_file(self, courseid, path, manifest=None,
+                           verify=False):
+        """
+        Uploads a local SCORM PIF (zip file), imports it and deletes the
+        uploaded file from the server. Returns the list of ImportResult
+        objects, or None if a manifest is given and shows that this exact
+        package has already been imported for the course.
+
+        Arguments:
+        courseid -- the unique identifier for the course
+        path -- the path to the local zip file to import
+        manifest -- (optional) the CoursePackageManifest used to skip
+            unchanged packages
+        verify -- if True, an unchanged package is only skipped if the
+            course list confirms the version recorded in the manifest
+        """
+        digest = None
+        if manifest is not None:
+            digest = manifest.get_digest(path)
+            verifyservice = None
+            if verify:
+                verifyservice = self
+            if manifest.is_unchanged(courseid, digest, verifyservice):
+                return None
+        uploadsvc = self.service.get_upload_service()
+        location = uploadsvc.upload_file(path)
+        try:
+            results = self.import_uploaded_course(courseid, location)
+        finally:
+            uploadsvc.delete_file(location)
+        if manifest is not None and len(results) > 0:
+            successful = True
+            for result in results:
+                successful = successful and result.wasSuccessful
+            if successful:
+                manifest.record_import(self, courseid, digest)
+        return results
+
     def delete_course(self, courseid):
         """
         Deletes the specified course.
@@ -246,9 +437,15 @@ class CourseService(object):
         """
         request = self.service.request()
         request.parameters['courseid'] = courseid
-        return request.call_service('rustici.course.deleteCourse')
+        result = request.call_service('rustici.course.deleteCourse')
+        if self.service.course_cache is not None:
+            self.service.course_cache.invalidate(courseid)
+        if self.service.asset_cache is not None:
+            self.service.asset_cache.invalidate(courseid)
+        self._drop_attribute_snapshot(courseid)
+        return result
 
-    def get_assets(self, courseid, path=None):
+    def get_assets(self, courseid, path=None, fileobj=None):
         """
         Downloads a file from a course by path. If no path is provided, all the
         course files will be downloaded contained in a zip file.
@@ -257,12 +454,23 @@ class CourseService(object):
         courseid -- the unique identifier for the course
         path -- the path (relative to the course root) of the file to download.
             If not provided or is None, all course files will be downloaded.
+        fileobj -- (optional) a file object, opened for reading and writing,
+            to stream the download to instead of returning it
         """
         request = self.service.request()
         request.parameters['courseid'] = courseid
         if (path is not None):
             request.parameters['path'] = path
-        return request.call_service('rustici.course.getAssets') 
+        if fileobj is None:
+            data = request.call_service_raw('rustici.course.getAssets')
+            request.check_raw(data)
+            return data
+        start = fileobj.tell()
+        request.call_service_raw('rustici.course.getAssets', fileobj=fileobj)
+        end = fileobj.tell()
+        fileobj.seek(start)
+        request.check_raw(fileobj)
+        fileobj.seek(end)
         
     def get_course_list(self, courseIdFilterRegex=None):
         """
@@ -278,6 +486,10 @@ class CourseService(object):
             request.parameters['filter'] = courseIdFilterRegex
         result = request.call_service('rustici.course.getCourseList')
         courses = CourseData.list_from_result(result)
+        if self.service.course_cache is not None:
+            self.service.course_cache.refresh(courses)
+        if self.service.asset_cache is not None:
+            self.service.asset_cache.refresh(courses)
         return courses 
 
     def get_preview_url(self, courseid, redirecturl, stylesheeturl=None):
@@ -354,14 +566,24 @@ class CourseService(object):
             atts[an.attributes['name'].value] = an.attributes['value'].value
         return atts
         
-    def update_attributes(self, courseid, attributePairs):
+    def update_attributes(self, courseid, attributePairs, diff=False):
         """
         Updates the specified attributes for the course.
 
         Arguments:
         courseid -- the unique identifier for the course
         attributePairs -- the attribute name/value pairs to update
+        diff -- if True, the pairs are first compared against the current
+            attributes (from the service's course_cache if set, otherwise
+            from a snapshot kept in memory since the first diffed update of
+            the course) and only the changed ones are sent. If nothing
+            changed, no call is made and an empty dictionary is returned
         """
+        if diff:
+            attributePairs = self._get_changed_attributes(courseid,
+                                                          attributePairs)
+            if not attributePairs:
+                return {}
         request = self.service.request()
         request.parameters['courseid'] = courseid
         for (key, value) in attributePairs.iteritems():
@@ -372,190 +594,1950 @@ class CourseService(object):
         atts = {}
         for an in attrNodes:
             atts[an.attributes['name'].value] = an.attributes['value'].value
+        if self.service.course_cache is not None:
+            self.service.course_cache.merge_attributes(courseid, atts)
+        else:
+            self._merge_attribute_snapshot(courseid, atts)
         return atts
-        
-
-class RegistrationService(object):
-    """
-    Service that provides methods for managing and interacting with
-    registrations on the SCORM Cloud. These methods correspond to the
-    "rustici.registration.*" web service methods.
-    """
 
-    def __init__(self, service):
-        self.service = service
-        
-    def create_registration(self, regid, courseid, userid, fname, lname, 
-                            email=None):
+    def update_attributes_many(self, updates, diff=True, workers=8):
         """
-        Creates a new registration (an instance of a user taking a course).
+        Updates the attributes of many courses concurrently. Returns a
+        dictionary mapping each courseid to the attributes that were updated,
+        or to the exception raised while updating that course.
 
         Arguments:
-        regid -- the unique identifier for the registration
-        courseid -- the unique identifier for the course
-        userid -- the unique identifier for the learner
-        fname -- the learner's first name
-        lname -- the learner's last name
-        email -- the learner's email address
+        updates -- a dictionary mapping courseids to the attribute name/value
+            pairs to update
+        diff -- if True, only changed attributes are sent; see
+            update_attributes
+        workers -- the number of concurrent updates
         """
-        if regid is None:
-            regid = str(uuid.uuid1())
-        request = self.service.request()
-        request.parameters['appid'] = self.service.config.appid
-        request.parameters['courseid'] = courseid
-        request.parameters['regid'] = regid
-        request.parameters['fname'] = fname
-        request.parameters['lname'] = lname
-        request.parameters['learnerid'] = userid
-        if email is not None:
-            request.parameters['email'] = email
-        xmldoc = request.call_service('rustici.registration.createRegistration')
-        successNodes = xmldoc.getElementsByTagName('success')
-        if successNodes.length == 0:
-            raise ScormCloudError("Create Registration failed.  " + 
-                                  xmldoc.err.attributes['msg'])
-        return regid
+        pending = Queue.Queue()
+        for item in updates.iteritems():
+            pending.put(item)
+        results = {}
+
+        def work():
+            while True:
+                try:
+                    (courseid, attributePairs) = pending.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    results[courseid] = self.update_attributes(
+                                        courseid, attributePairs, diff)
+                except Exception, ex:
+                    logging.warning('updating attributes of course %s '
+                                    'failed: %s' % (courseid, ex))
+                    results[courseid] = ex
+
+        threads = [threading.Thread(target=work)
+                   for i in range(min(workers, len(updates)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def _get_changed_attributes(self, courseid, attributePairs):
+        if self.service.course_cache is not None:
+            current = self.service.course_cache.get_attributes(courseid)
+        else:
+            current = self._get_attribute_snapshot(courseid)
+        changed = {}
+        for (key, value) in attributePairs.iteritems():
+            if isinstance(value, bool):
+                value = value and 'true' or 'false'
+            elif not isinstance(value, unicode):
+                value = str(value)
+            if key not in current or current[key] != value:
+                changed[key] = attributePairs[key]
+        return changed
+
+    def _get_attribute_snapshot(self, courseid):
+        service = self.service
+        service._course_attributes_lock.acquire()
+        try:
+            atts = service._course_attributes.get(courseid)
+            if atts is not None:
+                return dict(atts)
+        finally:
+            service._course_attributes_lock.release()
+        atts = self.get_attributes(courseid)
+        service._course_attributes_lock.acquire()
+        try:
+            # An update that finished meanwhile has the newer values.
+            return dict(service._course_attributes.setdefault(courseid, atts))
+        finally:
+            service._course_attributes_lock.release()
+
+    def _merge_attribute_snapshot(self, courseid, attributes):
+        service = self.service
+        service._course_attributes_lock.acquire()
+        try:
+            atts = service._course_attributes.get(courseid)
+            if atts is not None:
+                atts.update(attributes)
+        finally:
+            service._course_attributes_lock.release()
+
+    def _drop_attribute_snapshot(self, courseid):
+        service = self.service
+        service._course_attributes_lock.acquire()
+        try:
+            service._course_attributes.pop(courseid, None)
+        finally:
+            service._course_attributes_lock.release()
         
-    def get_launch_url(self, regid, redirecturl, cssUrl=None, courseTags=None, 
-                       learnerTags=None, registrationTags=None):
+
+class CourseIngestionPipeline(object):
+    """
+    Publishes a batch of course packages by running the upload, import and
+    cleanup steps as concurrent stages connected by bounded queues, so that
+    one package can be uploading while others are being imported or
+    cleaned up.
+    """
+
+    def __init__(self, service, upload_workers=4, import_workers=4,
+                 cleanup_workers=2, queue_size=8, manifest=None,
+                 verify=False):
         """
-        Gets the URL to directly launch the course in a web browser.
-        
         Arguments:
-        regid -- the unique identifier for the registration
-        redirecturl -- the URL to which the SCORM player will redirect upon
-            course exit
-        cssUrl -- the URL to a custom stylesheet
-        courseTags -- comma-delimited list of tags to associate with the
-            launched course
-        learnerTags -- comma-delimited list of tags to associate with the
-            learner launching the course
-        registrationTags -- comma-delimited list of tags to associate with the
-            launched registration
+        service -- the ScormCloudService to publish the courses with
+        upload_workers -- the number of concurrent uploads
+        import_workers -- the number of concurrent imports
+        cleanup_workers -- the number of concurrent uploaded file deletions
+        queue_size -- the number of packages that may wait between stages
+        manifest -- (optional) a CoursePackageManifest used to skip packages
+            that have already been imported unchanged
+        verify -- if True, packages are only skipped if the course list
+            confirms the version recorded in the manifest
         """
-        request = self.service.request()
-        request.parameters['regid'] = regid
-        request.parameters['redirecturl'] = redirecturl + '?regid=' + regid
-        if cssUrl is not None:
-            request.parameters['cssurl'] = cssUrl
-        if courseTags is not None:
-            request.parameters['coursetags'] = courseTags
-        if learnerTags is not None:
-            request.parameters['learnertags'] = learnerTags
-        if registrationTags is not None:
-            request.parameters['registrationTags'] = registrationTags
-        url = request.construct_url('rustici.registration.launch')
-        return url
-    
-    def get_registration_list(self, regIdFilterRegex=None, 
-                              courseIdFilterRegex=None):
+        self.service = service
+        self.manifest = manifest
+        self.verify = verify
+        self.upload_workers = upload_workers
+        self.import_workers = import_workers
+        self.cleanup_workers = cleanup_workers
+        self.queue_size = queue_size
+
+    def ingest(self, packages, get_courseid=None):
         """
-        Retrieves a list of registration associated with the configured AppID.
-        Can optionally be filtered by registration or course ID.
+        Uploads and imports each package, yielding an IngestionResult for
+        each package as soon as its import has completed or failed. The
+        uploaded files are deleted from the server after import.
 
         Arguments:
-        regIdFilterRegex -- (optional) the regular expression used to filter the 
-            list by registration ID
-        courseIdFilterRegex -- (optional) the regular expression used to filter
-            the list by course ID
+        packages -- a directory containing SCORM PIF (zip) files, or an
+            iterable of paths to PIF files
+        get_courseid -- (optional) a function returning the courseid for a
+            package path. By default, the file name without its extension is
+            used
         """
-        request = self.service.request()
-        if regIdFilterRegex is not None:
-            request.parameters['filter'] = regIdFilterRegex
-        if courseIdFilterRegex is not None:
-            request.parameters['coursefilter'] = courseIdFilterRegex
-            
-        result = request.call_service(
-                 'rustici.registration.getRegistrationList')
-        regs = RegistrationData.list_from_result(result)
-        return regs 
-        
-    def get_registration_result(self, regid, resultsformat):
+        if isinstance(packages, basestring):
+            directory = packages
+            packages = sorted([os.path.join(directory, name)
+                               for name in os.listdir(directory)
+                               if name.lower().endswith('.zip')])
+        if get_courseid is None:
+            get_courseid = self._default_courseid
+
+        uploads = Queue.Queue(self.queue_size)
+        imports = Queue.Queue(self.queue_size)
+        cleanups = Queue.Queue(self.queue_size)
+        results = Queue.Queue()
+
+        def upload(item):
+            try:
+                if self.manifest is not None:
+                    item.digest = self.manifest.get_digest(item.path)
+                    if self.manifest.is_unchanged(item.courseid, item.digest,
+                                                  self._verify_service()):
+                        item.skipped = True
+                        results.put(item)
+                        return
+                item.location = (self.service.get_upload_service()
+                                 .upload_file(item.path))
+            except Exception, ex:
+                item.error = ex
+                results.put(item)
+                return
+            imports.put(item)
+
+        def import_(item):
+            try:
+                courseservice = self.service.get_course_service()
+                item.results = courseservice.import_uploaded_course(
+                               item.courseid, item.location)
+                if self.manifest is not None and item.was_successful():
+                    self.manifest.record_import(courseservice, item.courseid,
+                                                item.digest)
+            except Exception, ex:
+                item.error = ex
+            results.put(item)
+            cleanups.put(item)
+
+        stages = [_PipelineStage(uploads, upload, self.upload_workers,
+                                 [imports]),
+                  _PipelineStage(imports, import_, self.import_workers,
+                                 [results, cleanups]),
+                  _PipelineStage(cleanups, self._cleanup,
+                                 self.cleanup_workers, [])]
+        for stage in stages:
+            stage.start()
+
+        def feed():
+            try:
+                try:
+                    for path in packages:
+                        try:
+                            courseid = get_courseid(path)
+                        except Exception, ex:
+                            item = IngestionResult(None, path)
+                            item.error = ex
+                            results.put(item)
+                            continue
+                        uploads.put(IngestionResult(courseid, path))
+                except Exception, ex:
+                    # The packages iterable itself failed; report it as a
+                    # result rather than losing the rest of the batch.
+                    logging.warning('listing course packages failed: %s' % ex)
+                    item = IngestionResult(None, None)
+                    item.error = ex
+                    results.put(item)
+            finally:
+                uploads.put(_PipelineStage.DONE)
+        feeder = threading.Thread(target=feed)
+        feeder.setDaemon(True)
+        feeder.start()
+
+        while True:
+            result = results.get()
+            if result is _PipelineStage.DONE:
+                break
+            yield result
+        for stage in stages:
+            stage.join()
+
+    def _verify_service(self):
+        if self.verify:
+            return self.service.get_course_service()
+        return None
+
+    def _cleanup(self, item):
+        try:
+            self.service.get_upload_service().delete_file(item.location)
+        except Exception, ex:
+            logging.warning('deleting uploaded file %s failed: %s' %
+                            (item.location, ex))
+
+    @staticmethod
+    def _default_courseid(path):
+        return os.path.splitext(os.path.basename(path))[0]
+
+
+class _PipelineStage(object):
+    """
+    A pool of worker threads that take items from an input queue and hand
+    them to a function. When the DONE marker reaches the stage and every
+    worker has finished, the marker is passed on to the downstream queues.
+    """
+
+    DONE = object()
+
+    def __init__(self, inqueue, func, workers, downstream):
+        self.inqueue = inqueue
+        self.func = func
+        self.downstream = downstream
+        self.workers = workers
+        self._running = workers
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work)
+            thread.setDaemon(True)
+            thread.start()
+            self._threads.append(thread)
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+    def _work(self):
+        while True:
+            item = self.inqueue.get()
+            if item is self.DONE:
+                # Put the marker back for the remaining workers.
+                self.inqueue.put(item)
+                break
+            self.func(item)
+        self._lock.acquire()
+        try:
+            self._running -= 1
+            last = self._running == 0
+        finally:
+            self._lock.release()
+        if last:
+            for queue in self.downstream:
+                queue.put(self.DONE)
+
+
+class CoursePackageManifest(object):
+    """
+    Local JSON manifest that maps each courseid to the SHA-1 digest of the
+    package last imported for it and the number of course versions after
+    the import. It allows publishing tools to skip the upload and import of
+    packages that have not changed. The same package may be recorded for
+    several courses.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            f = open(path, 'rb')
+            try:
+                entries = json.load(f)
+            finally:
+                f.close()
+            for (key, entry) in entries.iteritems():
+                if 'courseid' in entry:
+                    # Manifests written by earlier versions are keyed by
+                    # package digest.
+                    self._entries[entry['courseid']] = {
+                        'digest': key, 'version': entry['version']}
+                else:
+                    self._entries[key] = entry
+
+    @staticmethod
+    def get_digest(path):
         """
-        Gets information about the specified registration.
+        Returns the hex SHA-1 digest of the file's content.
 
         Arguments:
-        regid -- the unique identifier for the registration
-        resultsformat -- (optional) can be "course", "activity", or "full" to
-            determine the level of detail returned. The default is "course"
+        path -- the path to the package file
         """
-        request = self.service.request()
-        request.parameters['regid'] = regid
-        request.parameters['resultsformat'] = resultsformat
-        return request.call_service(
-               'rustici.registration.getRegistrationResult')
+        digest = sha1()
+        f = open(path, 'rb')
+        try:
+            while True:
+                chunk = f.read(65536)
+                if not chunk:
+                    break
+                digest.update(chunk)
+        finally:
+            f.close()
+        return digest.hexdigest()
 
-    def get_launch_history(self, regid):
+    def lookup(self, courseid):
         """
-        Retrieves a list of LaunchInfo objects describing each launch. These
-        LaunchInfo objects do not contain the full launch history log; use
-        get_launch_info to retrieve the full launch information.
+        Returns a dictionary with the digest and version recorded for the
+        course, or None if no package has been imported for it.
 
         Arguments:
-        regid -- the unique identifier for the registration
+        courseid -- the unique identifier for the course
         """
-        request = self.service.request()
-        request.parameters['regid'] = regid
-        return request.call_service('rustici.registration.getLaunchHistory')
-        
-    def reset_registration(self, regid):
+        self._lock.acquire()
+        try:
+            return self._entries.get(courseid)
+        finally:
+            self._lock.release()
+
+    def is_unchanged(self, courseid, digest, courseservice=None):
         """
-        Resets all status data for the specified registration, essentially
-        restarting the course for the associated learner.
+        Returns True if the package with this digest is the one last imported
+        for the course.
 
         Arguments:
-        regid -- the unique identifier for the registration
+        courseid -- the unique identifier for the course
+        digest -- the package digest, as returned by get_digest
+        courseservice -- (optional) if given, the CourseService used to check
+            that the course still has the number of versions recorded at
+            import time
         """
-        request = self.service.request()
-        request.parameters['regid'] = regid
-        return request.call_service('rustici.registration.resetRegistration')
-        
-    def reset_global_objectives(self, regid):
+        entry = self.lookup(courseid)
+        if entry is None or entry['digest'] != digest:
+            return False
+        if courseservice is None:
+            return True
+        version = self._get_version(courseservice, courseid)
+        return version is not None and version == entry['version']
+
+    def record_import(self, courseservice, courseid, digest):
         """
-        Clears global objective data for the specified registration.
+        Records that the package was imported for the course, looking up the
+        course's current number of versions.
 
         Arguments:
-        regid -- the unique identifier for the registration
+        courseservice -- the CourseService used to look up the version
+        courseid -- the unique identifier for the course
+        digest -- the package digest, as returned by get_digest
         """
-        request = self.service.request()
-        request.parameters['regid'] = regid
-        return request.call_service(
-               'rustici.registration.resetGlobalObjectives')
-        
-    def delete_registration(self, regid):
+        self.record(courseid, digest, self._get_version(courseservice,
+                                                        courseid))
+
+    def record(self, courseid, digest, version):
         """
-        Deletes the specified registration.
+        Records the package digest for the course and saves the manifest,
+        replacing any package previously recorded for the course.
 
         Arguments:
-        regid -- the unique identifier for the registration
+        courseid -- the unique identifier for the course
+        digest -- the package digest, as returned by get_digest
+        version -- the number of course versions after the import
         """
-        request = self.service.request()
-        request.parameters['regid'] = regid
-        return request.call_service('rustici.registration.deleteRegistration')
-        
+        self._lock.acquire()
+        try:
+            self._entries[courseid] = {'digest': digest, 'version': version}
+            self._save()
+        finally:
+            self._lock.release()
 
-class ReportingService(object):
+    def _save(self):
+        temppath = self.path + '.tmp'
+        f = open(temppath, 'wb')
+        try:
+            json.dump(self._entries, f)
+        finally:
+            f.close()
+        if os.path.exists(self.path) and sys.platform == 'win32':
+            os.remove(self.path)
+        os.rename(temppath, self.path)
+
+    @staticmethod
+    def _get_version(courseservice, courseid):
+        courses = courseservice.get_course_list('^' + re.escape(courseid) + '$')
+        for course in courses:
+            if course.courseId == courseid:
+                return str(course.numberOfVersions)
+        return None
+
+
+class CourseMetadataCache(object):
     """
-    Service that provides methods for interacting with the Reportage service.
+    On-disk cache for course metadata and attributes, keyed by courseid and
+    the course's number of versions. Each entry is stored in its own file
+    and only read when requested, and the known version of each course is
+    kept in a small index file, so opening the cache reads nothing else.
+
+    Set the cache as the course_cache attribute of the ScormCloudService to
+    have it refreshed by every get_course_list call, so that a version bump
+    drops the entries for the older version, and to have the attributes
+    entry updated by update_attributes.
     """
 
-    def __init__(self, service):
+    INDEX_FILE = 'versions.json'
+
+    def __init__(self, service, directory):
         self.service = service
-    
-    def get_reportage_date(self):
+        self.directory = directory
+        self._versions = None
+        # Bumped whenever a course's entries are dropped or changed, so that
+        # an entry fetched before then is not written over them.
+        self._generations = {}
+        self._lock = threading.RLock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def get_metadata(self, courseid):
         """
-        Gets the date/time, according to Reportage.
+        Returns the course metadata document, as returned by
+        CourseService.get_metadata.
+
+        Arguments:
+        courseid -- the unique identifier for the course
         """
-        reportUrl = (self._get_reportage_service_url() + 
-                    'Reportage/scormreports/api/getReportDate.php?appId=' + 
-                    self.service.config.appid)
-        cloudsocket = urllib2.urlopen(reportUrl,None)
-        reply = cloudsocket.read()
-        cloudsocket.close()
-        d = datetime.datetime
-        return d.strptime(reply,"%Y-%m-%d %H:%M:%S")
-        
-    def get_reportage_auth(self, navperm, allowadmin):
+        path = self._get_entry_path(courseid, 'metadata.xml')
+        generation = self._get_generation(courseid)
+        if path is not None and os.path.exists(path):
+            return minidom.parse(path)
+        xmldoc = self.service.get_course_service().get_metadata(courseid)
+        if path is not None:
+            self._write_entry(courseid, generation, path,
+                              xmldoc.toxml('utf-8'))
+        return xmldoc
+
+    def get_attributes(self, courseid):
+        """
+        Returns the dictionary of course attributes, as returned by
+        CourseService.get_attributes.
+
+        Arguments:
+        courseid -- the unique identifier for the course
+        """
+        path = self._get_entry_path(courseid, 'attributes.json')
+        generation = self._get_generation(courseid)
+        if path is not None and os.path.exists(path):
+            f = open(path, 'rb')
+            try:
+                return json.load(f)
+            finally:
+                f.close()
+        atts = self.service.get_course_service().get_attributes(courseid)
+        if path is not None:
+            self._write_entry(courseid, generation, path, json.dumps(atts))
+        return atts
+
+    def refresh(self, courses=None):
+        """
+        Records the number of versions of each course, dropping the cached
+        entries of courses whose version changed.
+
+        Arguments:
+        courses -- (optional) the list of CourseData objects to record. If
+            not provided, the full course list is retrieved
+        """
+        if courses is None:
+            self._load_course_list()
+            return
+        self._lock.acquire()
+        try:
+            versions = self._get_versions()
+            changed = False
+            for course in courses:
+                version = str(course.numberOfVersions)
+                if versions.get(course.courseId) != version:
+                    self._remove_entries(course.courseId)
+                    versions[course.courseId] = version
+                    changed = True
+            if changed:
+                self._save_versions()
+        finally:
+            self._lock.release()
+
+    def invalidate(self, courseid):
+        """
+        Drops all cached entries for the course, along with its known
+        version.
+
+        Arguments:
+        courseid -- the unique identifier for the course
+        """
+        self._lock.acquire()
+        try:
+            self._remove_entries(courseid)
+            if self._get_versions().pop(courseid, None) is not None:
+                self._save_versions()
+        finally:
+            self._lock.release()
+
+    def merge_attributes(self, courseid, attributes):
+        """
+        Updates the cached attributes of the course with the given
+        attributes, such as those returned by update_attributes. Does
+        nothing if the course's attributes are not cached.
+
+        Arguments:
+        courseid -- the unique identifier for the course
+        attributes -- the dictionary of attribute names and values
+        """
+        self._lock.acquire()
+        try:
+            self._bump_generation(courseid)
+            path = self._get_entry_path(courseid, 'attributes.json', False)
+            if path is None or not os.path.exists(path):
+                return
+            f = open(path, 'rb')
+            try:
+                atts = json.load(f)
+            finally:
+                f.close()
+            atts.update(attributes)
+            self._write(path, json.dumps(atts))
+        finally:
+            self._lock.release()
+
+    def _get_entry_path(self, courseid, name, lookup=True):
+        self._lock.acquire()
+        try:
+            version = self._get_versions().get(courseid)
+        finally:
+            self._lock.release()
+        if version is None and lookup:
+            self._load_course_list('^' + re.escape(courseid) + '$')
+            version = self._get_versions().get(courseid)
+        if version is None:
+            return None
+        return os.path.join(self._get_course_dir(courseid),
+                            version + '.' + name)
+
+    def _load_course_list(self, courseIdFilterRegex=None):
+        courseservice = self.service.get_course_service()
+        courses = courseservice.get_course_list(courseIdFilterRegex)
+        # get_course_list already refreshes the cache when it is set as the
+        # service's course_cache.
+        if self.service.course_cache is not self:
+            self.refresh(courses)
+
+    def _get_course_dir(self, courseid):
+        if isinstance(courseid, unicode):
+            courseid = courseid.encode('utf-8')
+        return os.path.join(self.directory, md5(courseid).hexdigest())
+
+    def _get_generation(self, courseid):
+        self._lock.acquire()
+        try:
+            return self._generations.get(courseid, 0)
+        finally:
+            self._lock.release()
+
+    def _bump_generation(self, courseid):
+        self._generations[courseid] = self._generations.get(courseid, 0) + 1
+
+    def _write_entry(self, courseid, generation, path, data):
+        self._lock.acquire()
+        try:
+            # Skip the write if the course was invalidated, refreshed to a
+            # new version or updated while the entry was being fetched.
+            if self._generations.get(courseid, 0) == generation:
+                self._write(path, data)
+        finally:
+            self._lock.release()
+
+    def _remove_entries(self, courseid):
+        self._bump_generation(courseid)
+        coursedir = self._get_course_dir(courseid)
+        if os.path.isdir(coursedir):
+            for name in os.listdir(coursedir):
+                os.remove(os.path.join(coursedir, name))
+
+    def _get_versions(self):
+        if self._versions is None:
+            self._versions = {}
+            path = os.path.join(self.directory, self.INDEX_FILE)
+            if os.path.exists(path):
+                f = open(path, 'rb')
+                try:
+                    self._versions = json.load(f)
+                finally:
+                    f.close()
+        return self._versions
+
+    def _save_versions(self):
+        self._write(os.path.join(self.directory, self.INDEX_FILE),
+                    json.dumps(self._versions))
+
+    def _write(self, path, data):
+        dirname = os.path.dirname(path)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        temppath = '%s.%s.tmp' % (path, uuid.uuid1())
+        f = open(temppath, 'wb')
+        try:
+            f.write(data)
+        finally:
+            f.close()
+        if os.path.exists(path) and sys.platform == 'win32':
+            os.remove(path)
+        os.rename(temppath, path)
+
+
+class CourseAssetCache(object):
+    """
+    Serves individual course files from a local copy of each course's full
+    asset zip, downloaded once per course version. The zip's member index is
+    built when the course is first opened, and files are read through a
+    memory map of the zip, so serving a file reads only that file's data.
+    The total size of the cached zips is capped; the least recently used
+    courses are evicted first.
+
+    Set the cache as the asset_cache attribute of the ScormCloudService to
+    have it drop a course's zip when a get_course_list call shows a new
+    version, or when the course is imported again or deleted.
+    """
+
+    LOCAL_HEADER = struct.Struct('<4s5H3I2H')
+
+    def __init__(self, service, directory, max_bytes=1024 * 1024 * 1024):
+        self.service = service
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._packages = OrderedDict()
+        self._versions = {}
+        self._downloads = {}
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._unopened = {}
+        for name in os.listdir(directory):
+            if name.endswith('.zip'):
+                path = os.path.join(directory, name)
+                self._unopened[path] = os.path.getsize(path)
+
+    def get_asset(self, courseid, path):
+        """
+        Returns the content of the course file, downloading the course's
+        assets first if they are not cached. Raises KeyError if the course
+        has no such file.
+
+        Arguments:
+        courseid -- the unique identifier for the course
+        path -- the path of the file, relative to the course root
+        """
+        name = self._normalize(path)
+        package = self._open(courseid)
+        self._lock.acquire()
+        try:
+            if package.closed:
+                # Evicted between opening and reading; read it again.
+                package = None
+            else:
+                info = package.members[name]
+                data = self._read_member(package, info)
+        finally:
+            self._lock.release()
+        if package is None:
+            return self.get_asset(courseid, path)
+        if info.compress_type == zipfile.ZIP_STORED:
+            return data
+        if info.compress_type == zipfile.ZIP_DEFLATED:
+            return zlib.decompress(data, -15)
+        zf = zipfile.ZipFile(package.path)
+        try:
+            return zf.read(info)
+        finally:
+            zf.close()
+
+    def get_paths(self, courseid):
+        """
+        Returns the sorted list of file paths in the course.
+
+        Arguments:
+        courseid -- the unique identifier for the course
+        """
+        return sorted(self._open(courseid).members.keys())
+
+    def refresh(self, courses):
+        """
+        Drops the cached zips of courses whose number of versions changed.
+
+        Arguments:
+        courses -- the list of CourseData objects
+        """
+        for course in courses:
+            version = str(course.numberOfVersions)
+            known = self._versions.get(course.courseId)
+            if known is not None and known != version:
+                self.invalidate(course.courseId)
+            self._versions[course.courseId] = version
+
+    def invalidate(self, courseid):
+        """
+        Drops the cached zip of the course.
+
+        Arguments:
+        courseid -- the unique identifier for the course
+        """
+        self._lock.acquire()
+        try:
+            self._versions.pop(courseid, None)
+            package = self._packages.pop(courseid, None)
+            if package is not None:
+                self._remove(package)
+            prefix = self._get_prefix(courseid)
+            for path in self._unopened.keys():
+                if os.path.basename(path).startswith(prefix):
+                    del self._unopened[path]
+                    os.remove(path)
+        finally:
+            self._lock.release()
+
+    def get_stats(self):
+        """
+        Returns a dictionary with the number of cached courses, their total
+        size in bytes, and the hit, miss and eviction counts.
+        """
+        self._lock.acquire()
+        try:
+            return {'courses': len(self._packages) + len(self._unopened),
+                    'bytes': self._get_total_size(),
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions}
+        finally:
+            self._lock.release()
+
+    def _open(self, courseid):
+        version = self._get_version(courseid)
+        self._lock.acquire()
+        try:
+            package = self._packages.get(courseid)
+            if package is not None and package.version == version:
+                self._packages[courseid] = self._packages.pop(courseid)
+                self.hits += 1
+                return package
+            download = self._downloads.get(courseid)
+            if download is None:
+                download = threading.Lock()
+                self._downloads[courseid] = download
+        finally:
+            self._lock.release()
+
+        # Only one thread downloads a course; others wait for it.
+        download.acquire()
+        try:
+            self._lock.acquire()
+            try:
+                package = self._packages.get(courseid)
+                if package is not None and package.version == version:
+                    self.hits += 1
+                    return package
+                if package is not None:
+                    self._remove(self._packages.pop(courseid))
+            finally:
+                self._lock.release()
+            path = os.path.join(self.directory, '%s%s.zip' %
+                                (self._get_prefix(courseid), version))
+            self._lock.acquire()
+            try:
+                # Files of other versions of the course are no longer needed.
+                prefix = self._get_prefix(courseid)
+                for unopened in self._unopened.keys():
+                    if unopened == path:
+                        del self._unopened[unopened]
+                    elif os.path.basename(unopened).startswith(prefix):
+                        del self._unopened[unopened]
+                        os.remove(unopened)
+            finally:
+                self._lock.release()
+            if not os.path.exists(path):
+                self.misses += 1
+                temppath = '%s.%s.tmp' % (path, uuid.uuid1())
+                f = open(temppath, 'w+b')
+                try:
+                    try:
+                        self.service.get_course_service().get_assets(
+                            courseid, fileobj=f)
+                    finally:
+                        f.close()
+                except:
+                    os.remove(temppath)
+                    raise
+                os.rename(temppath, path)
+            else:
+                self.hits += 1
+            package = _CachedPackage(path, version)
+            self._lock.acquire()
+            try:
+                self._packages[courseid] = package
+                self._evict(courseid)
+            finally:
+                self._lock.release()
+            return package
+        finally:
+            download.release()
+
+    def _get_version(self, courseid):
+        version = self._versions.get(courseid)
+        if version is None:
+            courses = self.service.get_course_service().get_course_list(
+                      '^' + re.escape(courseid) + '$')
+            if self.service.asset_cache is not self:
+                self.refresh(courses)
+            version = self._versions.get(courseid, '0')
+        return version
+
+    def _read_member(self, package, info):
+        header = self.LOCAL_HEADER.unpack_from(package.map, info.header_offset)
+        start = (info.header_offset + self.LOCAL_HEADER.size + header[9] +
+                 header[10])
+        return package.map[start:start + info.compress_size]
+
+    def _evict(self, keep):
+        while self._get_total_size() > self.max_bytes:
+            if self._unopened:
+                oldest = min(self._unopened.keys(), key=os.path.getmtime)
+                del self._unopened[oldest]
+                os.remove(oldest)
+            elif len(self._packages) > 1:
+                courseid = iter(self._packages).next()
+                if courseid == keep:
+                    break
+                self._remove(self._packages.pop(courseid))
+            else:
+                break
+            self.evictions += 1
+
+    def _get_total_size(self):
+        total = sum(self._unopened.values())
+        for package in self._packages.values():
+            total += package.size
+        return total
+
+    def _remove(self, package):
+        package.close()
+        if os.path.exists(package.path):
+            os.remove(package.path)
+
+    def _get_prefix(self, courseid):
+        if isinstance(courseid, unicode):
+            courseid = courseid.encode('utf-8')
+        return md5(courseid).hexdigest() + '-'
+
+    @staticmethod
+    def _normalize(path):
+        return path.replace('\\', '/').lstrip('/')
+
+
+class _CachedPackage(object):
+    def __init__(self, path, version):
+        self.path = path
+        self.version = version
+        self.closed = False
+        self._file = open(path, 'rb')
+        self.size = os.fstat(self._file.fileno()).st_size
+        self.map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        zf = zipfile.ZipFile(self._file)
+        self.members = {}
+        for info in zf.infolist():
+            if not info.filename.endswith('/'):
+                self.members[info.filename] = info
+        zf.close()
+
+    def close(self):
+        self.closed = True
+        self.map.close()
+        self._file.close()
+
+
+class RegistrationService(object):
+    """
+    Service that provides methods for managing and interacting with
+    registrations on the SCORM Cloud. These methods correspond to the
+    "rustici.registration.*" web service methods.
+    """
+
+    def __init__(self, service):
+        self.service = service
+        
+    def create_registration(self, regid, courseid, userid, fname, lname, 
+                            email=None, postbackurl=None, authtype=None,
+                            urlname=None, urlpass=None, resultsformat=None):
+        """
+        Creates a new registration (an instance of a user taking a course).
+
+        Arguments:
+        regid -- the unique identifier for the registration
+        courseid -- the unique identifier for the course
+        userid -- the unique identifier for the learner
+        fname -- the learner's first name
+        lname -- the learner's last name
+        email -- the learner's email address
+        postbackurl -- (optional) the URL to which the SCORM Cloud posts the
+            registration results whenever they change. See
+            RegistrationPostbackServer
+        authtype -- (optional) how the postback authenticates: "form" sends
+            the credentials as form fields, "httpbasic" as HTTP basic auth
+        urlname -- (optional) the user name sent with each postback
+        urlpass -- (optional) the password sent with each postback
+        resultsformat -- (optional) the level of detail of the posted
+            results: "course", "activity" or "full"
+        """
+        index = self.service.registration_index
+        if regid is None:
+            regid = str(uuid.uuid1())
+        elif index is not None and index.contains(regid):
+            raise ScormCloudError("Create Registration failed.  "
+                                  "Registration %s already exists." % regid)
+        request = self.service.request()
+        request.parameters['appid'] = self.service.config.appid
+        request.parameters['courseid'] = courseid
+        request.parameters['regid'] = regid
+        request.parameters['fname'] = fname
+        request.parameters['lname'] = lname
+        request.parameters['learnerid'] = userid
+        if email is not None:
+            request.parameters['email'] = email
+        if postbackurl is not None:
+            request.parameters['postbackurl'] = postbackurl
+        if authtype is not None:
+            request.parameters['authtype'] = authtype
+        if urlname is not None:
+            request.parameters['urlname'] = urlname
+        if urlpass is not None:
+            request.parameters['urlpass'] = urlpass
+        if resultsformat is not None:
+            request.parameters['resultsformat'] = resultsformat
+        xmldoc = request.call_service('rustici.registration.createRegistration')
+        successNodes = xmldoc.getElementsByTagName('success')
+        if successNodes.length == 0:
+            raise ScormCloudError("Create Registration failed.  " + 
+                                  xmldoc.err.attributes['msg'])
+        if index is not None:
+            index.add(regid)
+        return regid
+        
+    def get_launch_url(self, regid, redirecturl, cssUrl=None, courseTags=None, 
+                       learnerTags=None, registrationTags=None):
+        """
+        Gets the URL to directly launch the course in a web browser.
+        
+        Arguments:
+        regid -- the unique identifier for the registration
+        redirecturl -- the URL to which the SCORM player will redirect upon
+            course exit
+        cssUrl -- the URL to a custom stylesheet
+        courseTags -- comma-delimited list of tags to associate with the
+            launched course
+        learnerTags -- comma-delimited list of tags to associate with the
+            learner launching the course
+        registrationTags -- comma-delimited list of tags to associate with the
+            launched registration
+        """
+        request = self.service.request()
+        request.parameters['regid'] = regid
+        request.parameters['redirecturl'] = redirecturl + '?regid=' + regid
+        if cssUrl is not None:
+            request.parameters['cssurl'] = cssUrl
+        if courseTags is not None:
+            request.parameters['coursetags'] = courseTags
+        if learnerTags is not None:
+            request.parameters['learnertags'] = learnerTags
+        if registrationTags is not None:
+            request.parameters['registrationTags'] = registrationTags
+        url = request.construct_url('rustici.registration.launch')
+        return url
+    
+    def get_registration_list(self, regIdFilterRegex=None, 
+                              courseIdFilterRegex=None):
+        """
+        Retrieves a list of registration associated with the configured AppID.
+        Can optionally be filtered by registration or course ID.
+
+        Arguments:
+        regIdFilterRegex -- (optional) the regular expression used to filter the 
+            list by registration ID
+        courseIdFilterRegex -- (optional) the regular expression used to filter
+            the list by course ID
+        """
+        request = self.service.request()
+        if regIdFilterRegex is not None:
+            request.parameters['filter'] = regIdFilterRegex
+        if courseIdFilterRegex is not None:
+            request.parameters['coursefilter'] = courseIdFilterRegex
+            
+        result = request.call_service(
+                 'rustici.registration.getRegistrationList')
+        regs = RegistrationData.list_from_result(result)
+        if self.service.registration_index is not None:
+            for reg in regs:
+                self.service.registration_index.add(reg.registrationId)
+        return regs 
+        
+    def get_registration_result(self, regid, resultsformat):
+        """
+        Gets information about the specified registration.
+
+        Arguments:
+        regid -- the unique identifier for the registration
+        resultsformat -- (optional) can be "course", "activity", or "full" to
+            determine the level of detail returned. The default is "course"
+        """
+        request = self._get_registration_result_request(regid, resultsformat)
+        return request.call_service(
+               'rustici.registration.getRegistrationResult')
+
+    def get_registration_result_raw(self, regid, resultsformat):
+        """
+        Gets information about the specified registration as the raw,
+        unparsed response string. See get_registration_result.
+
+        Arguments:
+        regid -- the unique identifier for the registration
+        resultsformat -- (optional) can be "course", "activity", or "full" to
+            determine the level of detail returned. The default is "course"
+        """
+        request = self._get_registration_result_request(regid, resultsformat)
+        return request.call_service_raw(
+               'rustici.registration.getRegistrationResult')
+
+    def _get_registration_result_request(self, regid, resultsformat):
+        request = self.service.request()
+        request.parameters['regid'] = regid
+        request.parameters['resultsformat'] = resultsformat
+        return request
+
+    def get_launch_history(self, regid):
+        """
+        Retrieves a list of LaunchInfo objects describing each launch. These
+        LaunchInfo objects do not contain the full launch history log; use
+        get_launch_info to retrieve the full launch information.
+
+        Arguments:
+        regid -- the unique identifier for the registration
+        """
+        request = self.service.request()
+        request.parameters['regid'] = regid
+        result = request.call_service('rustici.registration.getLaunchHistory')
+        return LaunchInfo.list_from_result(result, self.service)
+
+    def get_launch_info(self, launchid):
+        """
+        Retrieves the full LaunchInfo for a single launch, including the
+        launch history log.
+
+        Arguments:
+        launchid -- the unique identifier for the launch, as found on the
+            LaunchInfo objects returned by get_launch_history
+        """
+        request = self.service.request()
+        request.parameters['launchid'] = launchid
+        result = request.call_service('rustici.registration.getLaunchInfo')
+        # The result already includes the log, if the launch has one.
+        launches = LaunchInfo.list_from_result(result)
+        if len(launches) == 0:
+            return None
+        return launches[0]
+        
+    def reset_registration(self, regid):
+        """
+        Resets all status data for the specified registration, essentially
+        restarting the course for the associated learner.
+
+        Arguments:
+        regid -- the unique identifier for the registration
+        """
+        request = self.service.request()
+        request.parameters['regid'] = regid
+        return request.call_service('rustici.registration.resetRegistration')
+        
+    def reset_global_objectives(self, regid):
+        """
+        Clears global objective data for the specified registration.
+
+        Arguments:
+        regid -- the unique identifier for the registration
+        """
+        request = self.service.request()
+        request.parameters['regid'] = regid
+        return request.call_service(
+               'rustici.registration.resetGlobalObjectives')
+        
+    def delete_registration(self, regid):
+        """
+        Deletes the specified registration.
+
+        Arguments:
+        regid -- the unique identifier for the registration
+        """
+        request = self.service.request()
+        request.parameters['regid'] = regid
+        result = request.call_service(
+                 'rustici.registration.deleteRegistration')
+        if self.service.registration_index is not None:
+            self.service.registration_index.remove(regid)
+        return result
+        
+
+class LaunchHistoryCache(object):
+    """
+    Keeps the launch history of each registration in memory so that repeated
+    history views only parse the launches that are new or still running.
+    The history is still retrieved on every view, but a response identical
+    to the previous one (by CRC-32) returns the cached list unparsed, and
+    otherwise only the launch elements that are not cached as finished are
+    parsed. Finished launches are kept as-is, along with any launch log that
+    has already been retrieved for them.
+    """
+
+    LAUNCH_PATTERN = re.compile(r'<launch\b([^>]*?)(?:/>|>.*?</launch>)',
+                                re.S)
+    ID_PATTERN = re.compile(r'\bid="([^"]*)"')
+
+    def __init__(self, service):
+        self.service = service
+        self._histories = {}
+        self._lock = threading.Lock()
+
+    def get_launch_history(self, regid):
+        """
+        Returns the list of LaunchInfo objects for the registration, reusing
+        the cached objects for launches that had already finished.
+
+        Arguments:
+        regid -- the unique identifier for the registration
+        """
+        request = self.service.request()
+        request.parameters['regid'] = regid
+        raw = request.call_service_raw(
+              'rustici.registration.getLaunchHistory')
+        fingerprint = zlib.crc32(raw)
+        self._lock.acquire()
+        try:
+            cached = self._histories.get(regid)
+        finally:
+            self._lock.release()
+        if cached is not None and cached[0] == fingerprint:
+            return list(cached[2])
+        request.check_raw(raw)
+        known = {}
+        if cached is not None:
+            known = cached[1]
+        current = {}
+        history = []
+        for match in self.LAUNCH_PATTERN.finditer(raw):
+            launchid = self.ID_PATTERN.search(match.group(1)).group(1)
+            info = known.get(launchid)
+            if info is None or not info.is_finished():
+                element = minidom.parseString(match.group(0)).documentElement
+                info = LaunchInfo(element, self.service)
+            current[launchid] = info
+            history.append(info)
+        self._lock.acquire()
+        try:
+            self._histories[regid] = (fingerprint, current, history)
+        finally:
+            self._lock.release()
+        return list(history)
+
+    def invalidate(self, regid=None):
+        """
+        Drops the cached launches for the registration, or for all
+        registrations if no regid is given.
+
+        Arguments:
+        regid -- (optional) the unique identifier for the registration
+        """
+        self._lock.acquire()
+        try:
+            if regid is None:
+                self._histories.clear()
+            else:
+                self._histories.pop(regid, None)
+        finally:
+            self._lock.release()
+
+
+class RegistrationResultPoller(object):
+    """
+    Polls the results of a set of registrations and hands each changed
+    result to a callback as a RegistrationResult. Every raw response is
+    fingerprinted first, so unchanged results are neither parsed nor passed
+    on. Each registration has its own poll interval, which backs off while
+    the result stays the same and drops back to the minimum once it changes.
+    """
+
+    def __init__(self, service, callback, resultsformat='course',
+                 min_interval=60, max_interval=900, backoff=2.0):
+        self.service = service
+        self.callback = callback
+        self.resultsformat = resultsformat
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def add(self, regid):
+        """
+        Starts polling the registration. The first poll is due immediately.
+
+        Arguments:
+        regid -- the unique identifier for the registration
+        """
+        self._lock.acquire()
+        try:
+            if regid not in self._entries:
+                self._entries[regid] = _PollEntry(self.min_interval)
+        finally:
+            self._lock.release()
+
+    def remove(self, regid):
+        """
+        Stops polling the registration.
+
+        Arguments:
+        regid -- the unique identifier for the registration
+        """
+        self._lock.acquire()
+        try:
+            self._entries.pop(regid, None)
+        finally:
+            self._lock.release()
+
+    def get_interval(self, regid):
+        """
+        Returns the current poll interval, in seconds, for the registration.
+        """
+        return self._entries[regid].interval
+
+    def next_poll_time(self):
+        """
+        Returns the time (as returned by time.time) at which the next
+        registration is due, or None if nothing is being polled.
+        """
+        self._lock.acquire()
+        try:
+            if not self._entries:
+                return None
+            return min([e.due for e in self._entries.values()])
+        finally:
+            self._lock.release()
+
+    def poll(self, now=None):
+        """
+        Polls every registration that is due and returns the list of
+        RegistrationResult objects that changed since the previous poll.
+
+        Arguments:
+        now -- (optional) the current time, as returned by time.time
+        """
+        if now is None:
+            now = time.time()
+        self._lock.acquire()
+        try:
+            due = [(regid, entry) for (regid, entry) in self._entries.items()
+                   if entry.due <= now]
+        finally:
+            self._lock.release()
+
+        regsvc = self.service.get_registration_service()
+        changed = []
+        for (regid, entry) in due:
+            try:
+                raw = regsvc.get_registration_result_raw(regid,
+                                                         self.resultsformat)
+                fingerprint = zlib.crc32(raw)
+                if fingerprint == entry.fingerprint:
+                    entry.back_off(self.backoff, self.max_interval, now)
+                    continue
+                result = RegistrationResult.from_result(
+                         self.service.request().get_xml(raw))
+                self.callback(result)
+            except Exception, ex:
+                # The fingerprint is only stored once the result has been
+                # delivered, so a failed poll is retried after backing off.
+                logging.warning('polling registration %s failed: %s' %
+                                (regid, ex))
+                entry.back_off(self.backoff, self.max_interval, now)
+                continue
+            entry.fingerprint = fingerprint
+            entry.reset(self.min_interval, now)
+            changed.append(result)
+        return changed
+
+    def run(self, stop_event):
+        """
+        Polls registrations as they become due until stop_event is set.
+
+        Arguments:
+        stop_event -- a threading.Event used to stop polling
+        """
+        while not stop_event.isSet():
+            try:
+                self.poll()
+            except Exception, ex:
+                logging.warning('polling registrations failed: %s' % ex)
+            nexttime = self.next_poll_time()
+            if nexttime is None:
+                wait = self.min_interval
+            else:
+                wait = max(nexttime - time.time(), 0)
+            stop_event.wait(wait)
+
+
+class _PollEntry(object):
+    def __init__(self, interval):
+        self.interval = interval
+        self.due = 0
+        self.fingerprint = None
+
+    def back_off(self, factor, maxinterval, now):
+        self.interval = min(self.interval * factor, maxinterval)
+        self.due = now + self.interval
+
+    def reset(self, interval, now):
+        self.interval = interval
+        self.due = now + self.interval
+
+
+class RegistrationExistenceIndex(object):
+    """
+    Compact index of known registration IDs that answers existence checks
+    without a round trip. A Bloom filter rules out unknown IDs, and an exact
+    set of IDs confirms the filter's positives and records deletions. With
+    confirm=False only the Bloom filter is kept, and a positive answer is
+    only a "maybe".
+
+    Set the index as the registration_index attribute of a
+    ScormCloudService to have create_registration refuse known IDs locally
+    and to keep the index up to date from create_registration,
+    delete_registration and get_registration_list calls.
+    """
+
+    def __init__(self, expected_items=100000, false_positive_rate=0.01,
+                 confirm=True):
+        """
+        Arguments:
+        expected_items -- the number of registrations the index is sized for
+        false_positive_rate -- the Bloom filter's target false positive rate
+            at expected_items
+        confirm -- if True, keep the exact set of IDs to confirm positives
+        """
+        expected_items = max(expected_items, 1)
+        self.bits = max(int(math.ceil(-expected_items *
+                                      math.log(false_positive_rate) /
+                                      (math.log(2) ** 2))), 8)
+        self.hashes = max(int(round(self.bits / float(expected_items) *
+                                    math.log(2))), 1)
+        self.items = 0
+        self.lookups = 0
+        self.false_positives = 0
+        self._filter = bytearray((self.bits + 7) // 8)
+        self._confirmed = None
+        self._removed = None
+        if confirm:
+            self._confirmed = set()
+            self._removed = set()
+        self._lock = threading.Lock()
+
+    def add(self, regid):
+        """
+        Records that the registration exists.
+
+        Arguments:
+        regid -- the unique identifier for the registration
+        """
+        self._lock.acquire()
+        try:
+            if self._confirmed is not None:
+                if regid in self._confirmed:
+                    return
+                self._confirmed.add(regid)
+                if regid in self._removed:
+                    # the filter bits were never cleared
+                    self._removed.discard(regid)
+                    return
+            added = False
+            for position in self._get_positions(regid):
+                mask = 1 << (position & 7)
+                if not self._filter[position >> 3] & mask:
+                    self._filter[position >> 3] |= mask
+                    added = True
+            # Without the exact set, an ID whose bits were all set already
+            # is taken to be a re-add.
+            if added or self._confirmed is not None:
+                self.items += 1
+        finally:
+            self._lock.release()
+
+    def remove(self, regid):
+        """
+        Records that the registration was deleted. Without the exact set,
+        the Bloom filter cannot forget an ID, so this has no effect.
+
+        Arguments:
+        regid -- the unique identifier for the registration
+        """
+        self._lock.acquire()
+        try:
+            if self._confirmed is not None and regid in self._confirmed:
+                self._confirmed.discard(regid)
+                self._removed.add(regid)
+        finally:
+            self._lock.release()
+
+    def contains(self, regid):
+        """
+        Returns True if the registration is known to exist, False if it is
+        not known, or None if the Bloom filter matches but there is no exact
+        set to confirm it.
+
+        Arguments:
+        regid -- the unique identifier for the registration
+        """
+        self._lock.acquire()
+        try:
+            self.lookups += 1
+            for position in self._get_positions(regid):
+                if not self._filter[position >> 3] & (1 << (position & 7)):
+                    return False
+            if self._confirmed is None:
+                return None
+            if regid in self._confirmed:
+                return True
+            if regid in self._removed:
+                return False
+            self.false_positives += 1
+            return False
+        finally:
+            self._lock.release()
+
+    def seed(self, service, courseIdFilterRegex=None):
+        """
+        Adds every registration from get_registration_list to the index.
+
+        Arguments:
+        service -- the ScormCloudService to list the registrations with
+        courseIdFilterRegex -- (optional) the regular expression used to
+            filter the list by course ID
+        """
+        regs = service.get_registration_service().get_registration_list(
+               courseIdFilterRegex=courseIdFilterRegex)
+        if service.registration_index is not self:
+            for reg in regs:
+                self.add(reg.registrationId)
+
+    def get_estimated_false_positive_rate(self):
+        """
+        Returns the Bloom filter's expected false positive rate for the
+        number of IDs added so far.
+        """
+        return (1 - math.exp(-self.hashes * self.items /
+                             float(self.bits))) ** self.hashes
+
+    def get_stats(self):
+        """
+        Returns a dictionary with the number of IDs added, the filter size
+        in bits, the number of hash functions, the number of lookups, the
+        number of filter matches the exact set rejected, and the estimated
+        and observed false positive rates.
+        """
+        self._lock.acquire()
+        try:
+            observed = None
+            if self._confirmed is not None and self.lookups > 0:
+                observed = self.false_positives / float(self.lookups)
+            return {'items': self.items,
+                    'bits': self.bits,
+                    'hashes': self.hashes,
+                    'lookups': self.lookups,
+                    'false_positives': self.false_positives,
+                    'estimated_false_positive_rate':
+                        self.get_estimated_false_positive_rate(),
+                    'observed_false_positive_rate': observed}
+        finally:
+            self._lock.release()
+
+    def _get_positions(self, regid):
+        if isinstance(regid, unicode):
+            regid = regid.encode('utf-8')
+        (first, second) = struct.unpack('<QQ', md5(regid).digest())
+        # Double hashing: derive all the positions from two hash values.
+        return [(first + i * second) % self.bits
+                for i in range(self.hashes)]
+
+
+class RegistrationWriteQueue(object):
+    """
+    Write-behind queue for registration creation. create_registration
+    records the registration in a local SQLite journal and returns its regid
+    immediately; background workers then create the queued registrations on
+    the SCORM Cloud in batches, retrying failed calls with an increasing
+    delay. Registrations still in the journal are picked up again when a
+    queue is opened on the same file after a restart. A registration whose
+    creation is refused is looked up with get_registration_list, and counts
+    as created if it turns out to exist already.
+    """
+
+    def __init__(self, service, path, workers=1, batch_size=20,
+                 max_attempts=5, retry_delay=30, idle_interval=1.0):
+        self.service = service
+        self.path = path
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.idle_interval = idle_interval
+        self._lock = threading.Lock()
+        self._inflight = set()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS registration_queue ('
+                         'regid TEXT PRIMARY KEY, courseid TEXT, '
+                         'userid TEXT, fname TEXT, lname TEXT, email TEXT, '
+                         'queued REAL, attempts INTEGER DEFAULT 0, '
+                         'next_attempt REAL, failed INTEGER DEFAULT 0, '
+                         'error TEXT)')
+        self._db.commit()
+
+    def create_registration(self, regid, courseid, userid, fname, lname,
+                            email=None):
+        """
+        Queues a new registration and returns its regid. Takes the same
+        arguments as RegistrationService.create_registration.
+
+        Arguments:
+        regid -- the unique identifier for the registration
+        courseid -- the unique identifier for the course
+        userid -- the unique identifier for the learner
+        fname -- the learner's first name
+        lname -- the learner's last name
+        email -- the learner's email address
+        """
+        if regid is None:
+            regid = str(uuid.uuid1())
+        now = time.time()
+        self._lock.acquire()
+        try:
+            self._db.execute('INSERT INTO registration_queue (regid, '
+                             'courseid, userid, fname, lname, email, queued, '
+                             'next_attempt) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                             (regid, courseid, userid, fname, lname, email,
+                              now, now))
+            self._db.commit()
+        finally:
+            self._lock.release()
+        self._wakeup.set()
+        return regid
+
+    def start(self):
+        """
+        Starts the background workers that flush the queue.
+        """
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work)
+            thread.setDaemon(True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """
+        Stops the background workers. Registrations that have not been
+        flushed stay in the journal.
+
+        Arguments:
+        timeout -- (optional) the number of seconds to wait for each worker
+        """
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def flush(self):
+        """
+        Creates every registration that is due, in the calling thread.
+        Returns the number of registrations created.
+        """
+        created = 0
+        while True:
+            batch = self._claim_batch()
+            if not batch:
+                return created
+            created += self._process(batch)
+
+    def get_depth(self):
+        """
+        Returns the number of registrations waiting to be created.
+        """
+        return self._query_one('SELECT COUNT(*) FROM registration_queue '
+                               'WHERE failed = 0')
+
+    def get_flush_lag(self):
+        """
+        Returns the age, in seconds, of the oldest registration waiting to
+        be created, or 0 if the queue is empty.
+        """
+        oldest = self._query_one('SELECT MIN(queued) FROM registration_queue '
+                                 'WHERE failed = 0')
+        if oldest is None:
+            return 0
+        return max(time.time() - oldest, 0)
+
+    def get_failed(self):
+        """
+        Returns a list of (regid, error) tuples for the registrations that
+        were given up on after max_attempts failed calls.
+        """
+        self._lock.acquire()
+        try:
+            return self._db.execute('SELECT regid, error FROM '
+                                    'registration_queue WHERE failed = 1 '
+                                    'ORDER BY queued').fetchall()
+        finally:
+            self._lock.release()
+
+    def get_stats(self):
+        """
+        Returns a dictionary with the queue depth, flush lag, number of
+        failed registrations and number of registrations being created.
+        """
+        return {'depth': self.get_depth(),
+                'lag': self.get_flush_lag(),
+                'failed': len(self.get_failed()),
+                'inflight': len(self._inflight)}
+
+    def _query_one(self, sql):
+        self._lock.acquire()
+        try:
+            return self._db.execute(sql).fetchone()[0]
+        finally:
+            self._lock.release()
+
+    def _work(self):
+        while not self._stop.isSet():
+            batch = self._claim_batch()
+            if batch:
+                self._process(batch)
+                continue
+            self._wakeup.wait(self.idle_interval)
+            self._wakeup.clear()
+
+    def _claim_batch(self):
+        self._lock.acquire()
+        try:
+            rows = self._db.execute('SELECT regid, courseid, userid, fname, '
+                                    'lname, email, attempts FROM '
+                                    'registration_queue WHERE failed = 0 AND '
+                                    'next_attempt <= ? ORDER BY queued',
+                                    (time.time(),))
+            batch = []
+            for row in rows:
+                if row[0] in self._inflight:
+                    continue
+                self._inflight.add(row[0])
+                batch.append(row)
+                if len(batch) >= self.batch_size:
+                    break
+            return batch
+        finally:
+            self._lock.release()
+
+    def _process(self, batch):
+        try:
+            return self._create_batch(batch)
+        finally:
+            self._lock.acquire()
+            try:
+                for row in batch:
+                    self._inflight.discard(row[0])
+            finally:
+                self._lock.release()
+
+    def _create_batch(self, batch):
+        regsvc = self.service.get_registration_service()
+        created = 0
+        done = []
+        retries = []
+        for (regid, courseid, userid, fname, lname, email, attempts) in batch:
+            try:
+                regsvc.create_registration(regid, courseid, userid, fname,
+                                           lname, email)
+                done.append((regid,))
+                created += 1
+            except Exception, ex:
+                if self._exists(regsvc, regid, ex):
+                    # An earlier attempt, possibly from before a crash,
+                    # reached the service even though it was not recorded.
+                    done.append((regid,))
+                    created += 1
+                    continue
+                attempts += 1
+                logging.warning('creating registration %s failed (attempt '
+                                '%d): %s' % (regid, attempts, ex))
+                delay = self.retry_delay * (2 ** (attempts - 1))
+                retries.append((attempts, time.time() + delay,
+                                int(attempts >= self.max_attempts), str(ex),
+                                regid))
+        self._lock.acquire()
+        try:
+            self._db.executemany('DELETE FROM registration_queue WHERE '
+                                 'regid = ?', done)
+            self._db.executemany('UPDATE registration_queue SET attempts = ?, '
+                                 'next_attempt = ?, failed = ?, error = ? '
+                                 'WHERE regid = ?', retries)
+            self._db.commit()
+        finally:
+            self._lock.release()
+        return created
+
+    @staticmethod
+    def _exists(regsvc, regid, ex):
+        # Only an error answer (or the local registration_index check) can
+        # mean the regid is taken; confirm it, whatever the error says.
+        if (not isinstance(ex, ScormCloudError) or
+            isinstance(ex, ScormCloudTimeoutError)):
+            return False
+        try:
+            regs = regsvc.get_registration_list('^' + re.escape(regid) + '$')
+        except Exception, err:
+            logging.warning('checking for registration %s failed: %s' %
+                            (regid, err))
+            return False
+        for reg in regs:
+            if reg.registrationId == regid:
+                return True
+        return False
+
+
+class RegistrationPostbackServer(object):
+    """
+    Embeddable HTTP server that receives the registration result postbacks
+    sent by the SCORM Cloud for registrations created with a postbackurl.
+    Each postback is parsed into a RegistrationResult and passed to the
+    callback and/or put on the queue. If a user name and password are set,
+    postbacks must carry them, either as form fields or as HTTP basic auth.
+    A postback whose callback raises is answered with a 500 error, so that
+    the SCORM Cloud sends it again later.
+    """
+
+    def __init__(self, host='', port=0, callback=None, queue=None,
+                 username=None, password=None):
+        """
+        Arguments:
+        host -- the interface to listen on; all interfaces by default
+        port -- the port to listen on; 0 picks a free port
+        callback -- (optional) a function called with each RegistrationResult
+        queue -- (optional) a Queue.Queue on which each RegistrationResult is
+            put
+        username -- (optional) the user name postbacks must carry
+        password -- (optional) the password postbacks must carry
+        """
+        self.callback = callback
+        self.queue = queue
+        self.username = username
+        self.password = password
+        self.received = 0
+        self.rejected = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self._server = _ThreadingHTTPServer((host, port), _PostbackHandler)
+        self._server.receiver = self
+        self._thread = None
+
+    def get_port(self):
+        """
+        Returns the port the server listens on.
+        """
+        return self._server.server_address[1]
+
+    def get_url(self, host='localhost'):
+        """
+        Returns the postback URL of the server.
+
+        Arguments:
+        host -- the host name under which the server can be reached
+        """
+        return 'http://%s:%d/' % (host, self.get_port())
+
+    def start(self):
+        """
+        Starts serving in a background thread.
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the server and closes its socket.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def handle_postback(self, body, authorization=None):
+        """
+        Handles the body of a postback request and returns the HTTP status
+        code to answer with.
+
+        Arguments:
+        body -- the form-encoded request body
+        authorization -- (optional) the Authorization request header
+        """
+        fields = urlparse.parse_qs(body)
+        if not self._is_authorized(fields, authorization):
+            self._count('rejected')
+            return 401
+        data = fields.get('data')
+        try:
+            result = RegistrationResult.from_result(
+                     minidom.parseString(data[0]))
+        except Exception, ex:
+            logging.warning('could not parse registration postback: %s' % ex)
+            result = None
+        if result is None:
+            self._count('rejected')
+            return 400
+        self._count('received')
+        if self.callback is not None:
+            try:
+                self.callback(result)
+            except Exception:
+                logging.exception('postback callback failed for '
+                                  'registration %s' % result.registrationId)
+                self._count('failed')
+                return 500
+        if self.queue is not None:
+            self.queue.put(result)
+        return 200
+
+    def _count(self, name):
+        self._lock.acquire()
+        try:
+            setattr(self, name, getattr(self, name) + 1)
+        finally:
+            self._lock.release()
+
+    def _is_authorized(self, fields, authorization):
+        if self.username is None and self.password is None:
+            return True
+        if (fields.get('username', [None])[0] == self.username and
+            fields.get('password', [None])[0] == self.password):
+            return True
+        if authorization is not None and authorization.startswith('Basic '):
+            try:
+                credentials = base64.b64decode(authorization[6:])
+            except TypeError:
+                return False
+            return credentials == '%s:%s' % (self.username, self.password)
+        return False
+
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn,
+                           BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class _PostbackHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = int(self.headers.getheader('content-length', 0))
+        body = self.rfile.read(length)
+        status = self.server.receiver.handle_postback(
+                 body, self.headers.getheader('authorization'))
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        self.end_headers()
+        self.wfile.write(self.responses[status][0])
+
+    def log_message(self, format, *args):
+        logging.debug('postback receiver: ' + format % args)
+
+
+class ReportingService(object):
+    """
+    Service that provides methods for interacting with the Reportage service.
+    """
+
+    def __init__(self, service):
+        self.service = service
+    
+    def get_reportage_date(self):
+        """
+        Gets the date/time, according to Reportage.
+        """
+        reportUrl = (self._get_reportage_service_url() + 
+                    'Reportage/scormreports/api/getReportDate.php?appId=' + 
+                    self.service.config.appid)
+        timeout = get_remaining_time(get_deadline(self.service.config.timeout))
+        reply = self.service.transport.send(reportUrl, None, None, timeout)
+        d = datetime.datetime
+        return d.strptime(reply,"%Y-%m-%d %H:%M:%S")
+        
+    def get_reportage_auth(self, navperm, allowadmin):
         """
         Authenticates against the Reportage application, returning a session
         string used to make subsequent calls to launchReport.
@@ -769,6 +2751,27 @@ class ScormCloudError(Exception):
     def __str__(self):
         return repr(self.msg)
 
+class ScormCloudTimeoutError(ScormCloudError):
+    """
+    Raised when a web service call runs out of time. The phase is "connect"
+    if the endpoint timed out before the request was sent in full,
+    "response" if it timed out afterwards, or None if the time budget ran
+    out before the endpoint was contacted.
+    """
+    def __init__(self, msg, phase=None):
+        ScormCloudError.__init__(self, msg)
+        self.phase = phase
+
+class ScormCloudServiceError(ScormCloudError):
+    """
+    Error response (stat="fail") returned by a web service method.
+    """
+    def __init__(self, msg, code=None):
+        ScormCloudError.__init__(self, msg)
+        self.code = code
+    def __str__(self):
+        return self.msg
+
 class ImportResult(object):
     wasSuccessful = False
     title = ""
@@ -776,6 +2779,7 @@ class ImportResult(object):
     parserWarnings = []
 
     def __init__(self, importResultElement):
+        self.parserWarnings = []
         if importResultElement is not None:
             self.wasSuccessful = (importResultElement.attributes['successful']
                                  .value == 'true')
@@ -833,6 +2837,34 @@ class CourseData(object):
             allResults.append(cls(course))
         return allResults
 
+class IngestionResult(object):
+    courseid = ""
+    path = ""
+    digest = None
+    location = None
+    results = []
+    error = None
+    skipped = False
+
+    def __init__(self, courseid, path):
+        self.courseid = courseid
+        self.path = path
+        self.results = []
+
+    def was_successful(self):
+        """
+        Returns True if the package was imported without errors or was
+        skipped because it had already been imported.
+        """
+        if self.skipped:
+            return True
+        if self.error is not None or len(self.results) == 0:
+            return False
+        for result in self.results:
+            if not result.wasSuccessful:
+                return False
+        return True
+
 class UploadToken(object):
     server = ""
     tokenid = ""
@@ -840,28 +2872,151 @@ class UploadToken(object):
         self.server = server
         self.tokenid = tokenid
 
-class RegistrationData(object):
-    courseId = ""
-    registrationId = ""
+class RegistrationData(object):
+    courseId = ""
+    registrationId = ""
+
+    def __init__(self, regDataElement):
+        if regDataElement is not None:
+            self.courseId = regDataElement.attributes['courseid'].value
+            self.registrationId = regDataElement.attributes['id'].value
+
+    @classmethod
+    def list_from_result(cls, xmldoc):
+        """
+        Returns a list of RegistrationData objects by parsing the result of an
+        API method that returns registration elements.
+
+        Arguments:
+        data -- the raw result of the API method
+        """
+        allResults = [];
+        regs = xmldoc.getElementsByTagName("registration")
+        for reg in regs:
+            allResults.append(cls(reg))
+        return allResults
+
+class RegistrationResult(object):
+    registrationId = ""
+    format = ""
+    instanceId = ""
+    complete = "unknown"
+    success = "unknown"
+    totalTime = "0"
+    score = "unknown"
+
+    def __init__(self, reportElement):
+        if reportElement is not None:
+            self.registrationId = reportElement.attributes['regid'].value
+            self.format = reportElement.attributes['format'].value
+            if reportElement.hasAttribute('instanceid'):
+                self.instanceId = reportElement.attributes['instanceid'].value
+            for node in reportElement.childNodes:
+                if node.nodeType != node.ELEMENT_NODE:
+                    continue
+                if node.firstChild is None:
+                    continue
+                value = node.firstChild.nodeValue
+                if node.tagName == 'complete':
+                    self.complete = value
+                elif node.tagName == 'success':
+                    self.success = value
+                elif node.tagName == 'totaltime':
+                    self.totalTime = value
+                elif node.tagName == 'score':
+                    self.score = value
+
+    @classmethod
+    def from_result(cls, xmldoc):
+        """
+        Returns a RegistrationResult by parsing the result of the
+        getRegistrationResult API method, or None if it holds no report.
+
+        Arguments:
+        data -- the raw result of the API method
+        """
+        reports = xmldoc.getElementsByTagName("registrationreport")
+        if reports.length == 0:
+            return None
+        return cls(reports[0])
+
+class LaunchInfo(object):
+    launchId = ""
+    completion = ""
+    satisfaction = ""
+    measureStatus = ""
+    normalizedMeasure = ""
+    experiencedDurationTracked = ""
+    launchTime = ""
+    exitTime = ""
+    updateDt = ""
 
-    def __init__(self, regDataElement):
-        if regDataElement is not None:
-            self.courseId = regDataElement.attributes['courseid'].value
-            self.registrationId = regDataElement.attributes['id'].value
+    def __init__(self, launchElement, service=None):
+        self._service = service
+        self._log = None
+        self._log_loaded = False
+        if launchElement is not None:
+            self.launchId = launchElement.attributes['id'].value
+            self.completion = self._get_text(launchElement, 'completion')
+            self.satisfaction = self._get_text(launchElement, 'satisfaction')
+            self.measureStatus = self._get_text(launchElement, 
+                                                'measure_status')
+            self.normalizedMeasure = self._get_text(launchElement,
+                                                    'normalized_measure')
+            self.experiencedDurationTracked = self._get_text(launchElement,
+                                            'experienced_duration_tracked')
+            self.launchTime = self._get_text(launchElement, 'launch_time')
+            self.exitTime = self._get_text(launchElement, 'exit_time')
+            self.updateDt = self._get_text(launchElement, 'update_dt')
+            logNodes = launchElement.getElementsByTagName('log')
+            if logNodes.length > 0:
+                self._log = logNodes[0].toxml()
+                self._log_loaded = True
+
+    @staticmethod
+    def _get_text(element, tagName):
+        nodes = element.getElementsByTagName(tagName)
+        if nodes.length == 0 or nodes[0].firstChild is None:
+            return ""
+        return nodes[0].firstChild.nodeValue
+
+    @property
+    def log(self):
+        """
+        The launch history log as an XML string. The log is not part of the
+        launch history listing, so it is retrieved with get_launch_info the
+        first time it is accessed. None if the launch has no log.
+        """
+        if not self._log_loaded and self._service is not None:
+            regsvc = self._service.get_registration_service()
+            info = regsvc.get_launch_info(self.launchId)
+            if info is not None:
+                self._log = info.log
+            self._log_loaded = True
+        return self._log
+
+    def is_finished(self):
+        """
+        Returns True if the launch has exited. The data for a finished launch
+        no longer changes on the server.
+        """
+        return self.exitTime != ""
 
     @classmethod
-    def list_from_result(cls, xmldoc):
+    def list_from_result(cls, xmldoc, service=None):
         """
-        Returns a list of RegistrationData objects by parsing the result of an
-        API method that returns registration elements.
+        Returns a list of LaunchInfo objects by parsing the result of an API
+        method that returns launch elements.
 
         Arguments:
         data -- the raw result of the API method
+        service -- (optional) the ScormCloudService used to lazily retrieve
+            the launch log
         """
         allResults = [];
-        regs = xmldoc.getElementsByTagName("registration")
-        for reg in regs:
-            allResults.append(cls(reg))
+        launches = xmldoc.getElementsByTagName("launch")
+        for launch in launches:
+            allResults.append(cls(launch, service))
         return allResults
 
 
@@ -876,6 +3031,7 @@ class ServiceRequest(object):
         self.service = service
         self.parameters = dict()
         self.file_ = None
+        self.timeout = None
 
     def call_service(self, method, serviceurl=None):
         """
@@ -888,13 +3044,99 @@ class ServiceRequest(object):
         serviceurl -- (optional) used to override the service host URL for a
             single call
         """
+        return self._call(method, serviceurl, True)
+
+    def call_service_raw(self, method, serviceurl=None, fileobj=None):
+        """
+        Calls the specified web service method like call_service, but returns
+        the raw response string without parsing it.
+
+        Arguments:
+        method -- the full name of the web service method to call.
+            For example: rustici.registration.createRegistration
+        serviceurl -- (optional) used to override the service host URL for a
+            single call
+        fileobj -- (optional) a file object to write the response to in
+            chunks instead of returning it
+        """
+        return self._call(method, serviceurl, False, fileobj)
+
+    def _call(self, method, serviceurl, parse, fileobj=None):
+        timeout = self.timeout
+        if timeout is None:
+            timeout = self.service.config.timeout
+        deadline = get_deadline(timeout)
+        limiter = self.service.limiter
+        if limiter is not None:
+            if not limiter.acquire(get_remaining_time(deadline)):
+                raise ScormCloudTimeoutError('Timed out waiting to call %s' %
+                                             method)
+        start = time.time()
+        failed = False
         postparams = None
-        #if self.file_ is not None:
-            # TODO: Implement file upload
-        url = self.construct_url(method, serviceurl)
-        rawresponse = self.send_post(url, postparams)
-        response = self.get_xml(rawresponse)
-        return response
+        try:
+            headers = None
+            if self.file_ is not None:
+                (postparams, headers) = self._encode_file(self.file_)
+            response = self._send(method, serviceurl, postparams, headers,
+                                  deadline, fileobj)
+            if parse:
+                check_deadline(deadline, method)
+                response = self.get_xml(response)
+                check_deadline(deadline, method)
+            return response
+        except Exception, ex:
+            if limiter is not None:
+                failed = limiter.is_overload(ex)
+            raise
+        finally:
+            if postparams is not None:
+                postparams.close()
+            if limiter is not None:
+                limiter.release(time.time() - start, failed)
+
+    def _send(self, method, serviceurl, postparams, headers, deadline,
+              fileobj=None):
+        router = self.service.router
+        if serviceurl is not None or router is None:
+            url = self.construct_url(method, serviceurl)
+            return self.send_post(url, postparams, headers, deadline, fileobj)
+        if fileobj is not None:
+            offset = fileobj.tell()
+        tried = []
+        error = ScormCloudError('No service endpoint is available.')
+        while True:
+            endpoint = router.choose(tried)
+            if endpoint is None:
+                raise error
+            url = self.construct_url(method, endpoint)
+            if fileobj is not None:
+                # Drop whatever the failed endpoint wrote.
+                fileobj.seek(offset)
+                fileobj.truncate()
+            if postparams is not None:
+                postparams.seek(0)
+            start = time.time()
+            attempt = deadline
+            if deadline is not None and method in router.idempotent_methods:
+                # Leave time to fail over to the endpoints not tried yet.
+                untried = len(router.endpoints) - len(tried)
+                attempt = start + (deadline - start) / max(untried, 1)
+            try:
+                response = self.send_post(url, postparams, headers, attempt,
+                                          fileobj)
+            except Exception, ex:
+                if not router.is_endpoint_failure(ex):
+                    raise
+                router.report_failure(endpoint)
+                if (not router.can_fail_over(method, ex) or
+                    get_remaining_time(deadline) == 0):
+                    raise
+                tried.append(endpoint)
+                error = ex
+                continue
+            router.report_success(endpoint, time.time() - start)
+            return response
 
     def construct_url(self, method, serviceurl=None):
         """
@@ -921,6 +3163,24 @@ class ServiceRequest(object):
               self._encode_and_sign(params))
         return url
 
+    def check_raw(self, raw):
+        """
+        Raises an error if the raw response string of a method that returns
+        file data is an error response.
+
+        Arguments:
+        raw -- the raw response string from an API method call, or a file
+            object positioned at its start
+        """
+        if hasattr(raw, 'read'):
+            head = raw.read(512)
+            if '<rsp' in head and 'stat="fail"' in head:
+                self.get_xml(head + raw.read())
+            return
+        head = raw[:512]
+        if '<rsp' in head and 'stat="fail"' in head:
+            self.get_xml(raw)
+
     def get_xml(self, raw):
         """
         Parses the raw response string as XML and asserts that there was no
@@ -933,16 +3193,59 @@ class ServiceRequest(object):
         rsp = xmldoc.documentElement
         if rsp.attributes['stat'].value != 'ok':
             err = rsp.firstChild
-            raise Exception('SCORM Cloud Error: %s - %s' %
-                            (err.attributes['code'].value, 
-                             err.attributes['msg'].value))
+            raise ScormCloudServiceError('SCORM Cloud Error: %s - %s' %
+                                         (err.attributes['code'].value, 
+                                          err.attributes['msg'].value),
+                                         err.attributes['code'].value)
         return xmldoc
 
-    def send_post(self, url, postparams):
-        cloudsocket = urllib2.urlopen(url, postparams)
-        reply = cloudsocket.read()
-        cloudsocket.close()
-        return reply
+    def send_post(self, url, postparams, headers=None, deadline=None,
+                  fileobj=None):
+        check_deadline(deadline, url)
+        transport = self.service.transport
+        timeout = get_remaining_time(deadline)
+        if fileobj is None:
+            return transport.send(url, postparams, headers, timeout)
+        if hasattr(transport, 'send_to_file'):
+            transport.send_to_file(url, postparams, fileobj, headers, timeout)
+        else:
+            fileobj.write(transport.send(url, postparams, headers, timeout))
+
+    def _encode_file(self, path):
+        """
+        Encodes the file as a multipart/form-data POST body. Returns the body,
+        as a file object that reads the file from disk as it is sent, and
+        the headers to send with it.
+
+        Arguments:
+        path -- the path to the file to encode
+        """
+        digest = md5()
+        f = open(path, 'rb')
+        try:
+            while True:
+                chunk = f.read(65536)
+                if not chunk:
+                    break
+                digest.update(chunk)
+        finally:
+            f.close()
+        # Derive the boundary from the content so that the same file always
+        # produces the same request body.
+        boundary = '----scormcloud' + digest.hexdigest()
+        filename = os.path.basename(path)
+        if isinstance(filename, unicode):
+            filename = filename.encode('utf-8')
+        body = _MultipartBody('--' + boundary + '\r\n' +
+                              'Content-Disposition: form-data; '
+                              'name="filedata"; '
+                              'filename="' + filename + '"\r\n' +
+                              'Content-Type: application/octet-stream'
+                              '\r\n\r\n',
+                              path, '\r\n--' + boundary + '--\r\n')
+        headers = {'Content-Type': 'multipart/form-data; boundary=' + boundary,
+                   'Content-Length': str(len(body))}
+        return (body, headers)
 
     def _encode_and_sign(self, dictionary):
         """
@@ -967,6 +3270,956 @@ class ServiceRequest(object):
         return '&'.join(values)
 
 
+class _MultipartBody(object):
+    """
+    Read-only file object over a request body made of a prefix string, the
+    content of a file and a suffix string. The file is read as the body is
+    sent, so it is never held in memory as a whole.
+    """
+
+    def __init__(self, prefix, path, suffix):
+        self._parts = [prefix, None, suffix]
+        self._path = path
+        self._length = len(prefix) + os.path.getsize(path) + len(suffix)
+        self._file = None
+        self._index = 0
+        self._offset = 0
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        chunks = []
+        while size != 0 and self._index < len(self._parts):
+            part = self._parts[self._index]
+            if part is None:
+                if self._file is None:
+                    self._file = open(self._path, 'rb')
+                chunk = self._file.read(size)
+                if not chunk:
+                    self.close()
+                    self._index += 1
+                    continue
+            else:
+                if size < 0:
+                    chunk = part[self._offset:]
+                else:
+                    chunk = part[self._offset:self._offset + size]
+                self._offset += len(chunk)
+                if self._offset >= len(part):
+                    self._index += 1
+                    self._offset = 0
+            chunks.append(chunk)
+            if size > 0:
+                size -= len(chunk)
+        return ''.join(chunks)
+
+    def seek(self, offset, whence=0):
+        if offset != 0 or whence != 0:
+            raise IOError('Request bodies can only be rewound.')
+        self.close()
+        self._index = 0
+        self._offset = 0
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class AdaptiveConcurrencyLimiter(object):
+    """
+    Limits the number of concurrent web service calls, adjusting the limit
+    with additive increase/multiplicative decrease (AIMD). The limit grows by
+    roughly `increase` per limit's worth of successful calls while latency
+    stays close to the lowest latency observed, and is multiplied by
+    `decrease` when latency rises beyond `tolerance` times that baseline or
+    a call fails on the server side: a connection or socket error, a
+    timeout, an HTTP 5xx or 429 response, an unparseable response, or an
+    error response whose code is in `server_error_codes`. Other error
+    responses, such as an unknown regid, count as completed calls. The web
+    service does not set apart the error codes of its own failures, so
+    `server_error_codes` is empty by default, and error responses parsed by
+    get_xml never cut the limit unless their codes are configured. Set it
+    as the limiter attribute of a ScormCloudService to apply it to every
+    call made through that service.
+    """
+
+    def __init__(self, initial_limit=4, min_limit=1, max_limit=64,
+                 increase=1.0, decrease=0.5, tolerance=1.5, smoothing=0.2,
+                 baseline_drift=0.01, server_error_codes=()):
+        """
+        Arguments:
+        initial_limit -- the concurrency limit to start with
+        min_limit -- the lowest the limit can be cut to
+        max_limit -- the highest the limit can grow to
+        increase -- the amount the limit grows by per limit's worth of
+            successful calls
+        decrease -- the factor the limit is multiplied by when cut
+        tolerance -- the factor of the baseline latency beyond which the
+            limit is cut
+        smoothing -- the weight of each new latency sample
+        baseline_drift -- how fast the baseline follows a rise in latency
+        server_error_codes -- (optional) the web service error codes that
+            mean the service itself failed and should cut the limit
+        """
+        self.server_error_codes = set([str(c) for c in server_error_codes])
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.baseline_drift = baseline_drift
+        self.inflight = 0
+        self.gradient = 1.0
+        self._limit = float(initial_limit)
+        self._baseline = None
+        self._latency = None
+        self._last_decrease = 0
+        self._cond = threading.Condition()
+
+    def get_limit(self):
+        """
+        Returns the current concurrency limit.
+        """
+        return max(int(self._limit), self.min_limit)
+
+    limit = property(get_limit)
+
+    def get_stats(self):
+        """
+        Returns a dictionary with the current limit, number of calls in
+        flight, smoothed and baseline latency and the latency gradient
+        (baseline / smoothed latency; 1.0 means latency is flat).
+        """
+        self._cond.acquire()
+        try:
+            return {'limit': self.get_limit(),
+                    'inflight': self.inflight,
+                    'latency': self._latency,
+                    'baseline': self._baseline,
+                    'gradient': self.gradient}
+        finally:
+            self._cond.release()
+
+    def acquire(self, timeout=None):
+        """
+        Blocks until a call may be made under the current limit. Returns
+        False if the timeout expired first.
+
+        Arguments:
+        timeout -- (optional) the maximum number of seconds to wait
+        """
+        end = None
+        if timeout is not None:
+            end = time.time() + timeout
+        self._cond.acquire()
+        try:
+            while self.inflight >= self.get_limit():
+                if end is None:
+                    self._cond.wait()
+                else:
+                    remaining = end - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+            self.inflight += 1
+            return True
+        finally:
+            self._cond.release()
+
+    def release(self, latency, failed=False):
+        """
+        Records the outcome of a call made after acquire and adjusts the
+        limit.
+
+        Arguments:
+        latency -- the duration of the call, in seconds
+        failed -- True if the call failed on the server side; see
+            is_overload
+        """
+        self._cond.acquire()
+        try:
+            self.inflight -= 1
+            if failed:
+                self._decrease()
+            else:
+                self._record(latency)
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+
+    def is_overload(self, ex):
+        """
+        Returns True if the exception raised by a call shows a server-side
+        failure that should cut the limit.
+
+        Arguments:
+        ex -- the exception raised by the call
+        """
+        if isinstance(ex, ScormCloudServiceError):
+            return ex.code in self.server_error_codes
+        if isinstance(ex, urllib2.HTTPError):
+            return ex.code >= 500 or ex.code == 429
+        return isinstance(ex, (ScormCloudTimeoutError, urllib2.URLError,
+                               socket.error, httplib.HTTPException,
+                               ExpatError))
+
+    def _record(self, latency):
+        if self._latency is None:
+            self._latency = latency
+            self._baseline = latency
+        else:
+            self._latency += self.smoothing * (latency - self._latency)
+            if self._latency < self._baseline:
+                self._baseline = self._latency
+            else:
+                # Let the baseline follow a lasting shift in latency slowly,
+                # at about baseline_drift per round trip.
+                self._baseline += (self.baseline_drift / self._limit *
+                                   (self._latency - self._baseline))
+        if self._latency > 0:
+            self.gradient = self._baseline / self._latency
+        else:
+            self.gradient = 1.0
+        if self._latency > self._baseline * self.tolerance:
+            self._decrease()
+        else:
+            self._limit = min(self._limit + self.increase / self._limit,
+                              float(self.max_limit))
+
+    def _decrease(self):
+        # Only cut once per round trip, so that the calls that were already
+        # in flight when latency rose don't each cut the limit again.
+        now = time.time()
+        if self._latency is not None and (now - self._last_decrease <
+                                          self._latency):
+            return
+        self._last_decrease = now
+        self._limit = max(self._limit * self.decrease, float(self.min_limit))
+
+
+class RegistrationResultAnalytics(object):
+    """
+    Columnar store of registration results that computes course and learner
+    statistics with vectorized NumPy operations. Results are added or
+    replaced one registration at a time as they arrive. The counts, rates,
+    mean scores and total times of each course and learner are kept up to
+    date as results arrive; the score histograms and time percentiles are
+    computed from the current columns on demand. Requires NumPy.
+
+    The totaltime of a result is taken to be in seconds and its score to be
+    on a 0-100 scale; unknown values are left out of the statistics that
+    need them.
+    """
+
+    TOTALS = ('count', 'completed', 'passed', 'decided', 'scored',
+              'score_sum', 'time_sum')
+
+    def __init__(self, capacity=1024):
+        if numpy is None:
+            raise ScormCloudError('RegistrationResultAnalytics requires '
+                                  'NumPy.')
+        self.size = 0
+        self._rows = {}
+        self._courses = {}
+        self._courseids = []
+        self._learners = {}
+        self._learnerids = []
+        self._course = numpy.zeros(capacity, numpy.int32)
+        self._learner = numpy.zeros(capacity, numpy.int32)
+        self._complete = numpy.zeros(capacity, numpy.int8)
+        self._success = numpy.zeros(capacity, numpy.int8)
+        self._score = numpy.zeros(capacity, numpy.float64)
+        self._time = numpy.zeros(capacity, numpy.float64)
+        # Running totals per course and per learner, one row per group and
+        # one column per entry of TOTALS.
+        self._course_totals = numpy.zeros((0, len(self.TOTALS)))
+        self._learner_totals = numpy.zeros((0, len(self.TOTALS)))
+
+    def update(self, result, courseid, learnerid=None):
+        """
+        Adds the registration result, replacing any earlier result for the
+        same registration.
+
+        Arguments:
+        result -- the RegistrationResult
+        courseid -- the unique identifier for the registration's course
+        learnerid -- (optional) the unique identifier for the learner
+        """
+        row = self._rows.get(result.registrationId)
+        if row is None:
+            if self.size == len(self._course):
+                self._grow()
+            row = self.size
+            self._rows[result.registrationId] = row
+            self.size += 1
+        else:
+            self._add_totals(row, -1)
+        self._course[row] = self._get_index(self._courses, self._courseids,
+                                            courseid)
+        if learnerid is None:
+            self._learner[row] = -1
+        else:
+            self._learner[row] = self._get_index(self._learners,
+                                                 self._learnerids, learnerid)
+        self._complete[row] = {'complete': 1,
+                               'incomplete': 0}.get(result.complete, -1)
+        self._success[row] = {'passed': 1,
+                              'failed': 0}.get(result.success, -1)
+        self._score[row] = self._to_float(result.score)
+        self._time[row] = self._to_float(result.totalTime)
+        self._add_totals(row, 1)
+
+    def update_many(self, results):
+        """
+        Adds a sequence of registration results; see update.
+
+        Arguments:
+        results -- an iterable of (result, courseid, learnerid) tuples
+        """
+        for (result, courseid, learnerid) in results:
+            self.update(result, courseid, learnerid)
+
+    def course_stats(self, percentiles=(50, 90, 99), bins=10):
+        """
+        Returns a dictionary mapping each courseid to a dictionary of
+        statistics: registrations, completion_rate, pass_rate (of the
+        registrations with a known outcome), mean_score, score_histogram
+        (counts of known scores in `bins` equal ranges of 0-100) and
+        time_percentiles (a dictionary of the requested percentiles of
+        totaltime, in seconds).
+
+        Arguments:
+        percentiles -- the totaltime percentiles to compute
+        bins -- the number of score histogram bins
+        """
+        n = len(self._courseids)
+        group = self._course[:self.size]
+        stats = self._get_rates(self._course_totals[:n])
+        score = self._score[:self.size]
+        known = ~numpy.isnan(score)
+        binned = numpy.clip((score[known] * bins / 100.0).astype(numpy.int64),
+                            0, bins - 1)
+        histogram = numpy.bincount(group[known] * bins + binned,
+                                   minlength=n * bins).reshape((n, bins))
+        times = self._group_percentiles(group, self._time[:self.size], n,
+                                        percentiles)
+        result = {}
+        for (i, courseid) in enumerate(self._courseids):
+            result[courseid] = {
+                'registrations': int(stats['count'][i]),
+                'completion_rate': self._to_stat(stats['completion_rate'][i]),
+                'pass_rate': self._to_stat(stats['pass_rate'][i]),
+                'mean_score': self._to_stat(stats['mean_score'][i]),
+                'score_histogram': histogram[i].tolist(),
+                'time_percentiles': dict([(p, self._to_stat(times[j][i]))
+                                          for (j, p) in
+                                          enumerate(percentiles)])}
+        return result
+
+    def learner_stats(self):
+        """
+        Returns a dictionary mapping each learnerid to a dictionary of
+        statistics: registrations, completion_rate, pass_rate, mean_score and
+        total_time (in seconds). Results added without a learnerid are left
+        out.
+        """
+        n = len(self._learnerids)
+        totals = self._learner_totals[:n]
+        stats = self._get_rates(totals)
+        result = {}
+        for (i, learnerid) in enumerate(self._learnerids):
+            result[learnerid] = {
+                'registrations': int(stats['count'][i]),
+                'completion_rate': self._to_stat(stats['completion_rate'][i]),
+                'pass_rate': self._to_stat(stats['pass_rate'][i]),
+                'mean_score': self._to_stat(stats['mean_score'][i]),
+                'total_time': float(totals[i, self.TOTALS.index('time_sum')])}
+        return result
+
+    def _add_totals(self, row, sign):
+        score = self._score[row]
+        time = self._time[row]
+        contribution = numpy.array([1.0,
+                                    self._complete[row] == 1,
+                                    self._success[row] == 1,
+                                    self._success[row] >= 0,
+                                    not numpy.isnan(score),
+                                    numpy.nan_to_num(score),
+                                    numpy.nan_to_num(time)]) * sign
+        self._course_totals = self._get_totals(self._course_totals,
+                                               self._course[row])
+        self._course_totals[self._course[row]] += contribution
+        if self._learner[row] >= 0:
+            self._learner_totals = self._get_totals(self._learner_totals,
+                                                    self._learner[row])
+            self._learner_totals[self._learner[row]] += contribution
+
+    @staticmethod
+    def _get_totals(totals, index):
+        if index < len(totals):
+            return totals
+        grown = numpy.zeros((max(len(totals) * 2, index + 1),
+                             totals.shape[1]))
+        grown[:len(totals)] = totals
+        return grown
+
+    def _get_rates(self, totals):
+        column = dict([(name, totals[:, i])
+                       for (i, name) in enumerate(self.TOTALS)])
+        olderr = numpy.seterr(divide='ignore', invalid='ignore')
+        try:
+            return {'count': column['count'],
+                    'completion_rate': column['completed'] / column['count'],
+                    'pass_rate': column['passed'] / column['decided'],
+                    'mean_score': column['score_sum'] / column['scored']}
+        finally:
+            numpy.seterr(**olderr)
+
+    def _group_percentiles(self, group, values, n, percentiles):
+        known = ~numpy.isnan(values)
+        group = group[known]
+        values = values[known]
+        order = numpy.lexsort((values, group))
+        group = group[order]
+        values = values[order]
+        starts = numpy.searchsorted(group, numpy.arange(n), 'left')
+        counts = numpy.searchsorted(group, numpy.arange(n), 'right') - starts
+        if len(values) == 0:
+            return [numpy.repeat(numpy.nan, n) for p in percentiles]
+        result = []
+        for p in percentiles:
+            # Linear interpolation between the closest ranks, computed for
+            # every group at once.
+            pos = starts + (counts - 1) * (p / 100.0)
+            lower = numpy.clip(numpy.floor(pos).astype(numpy.int64), 0,
+                               len(values) - 1)
+            upper = numpy.clip(numpy.ceil(pos).astype(numpy.int64), 0,
+                               len(values) - 1)
+            fraction = pos - numpy.floor(pos)
+            value = values[lower] + (values[upper] - values[lower]) * fraction
+            result.append(numpy.where(counts > 0, value, numpy.nan))
+        return result
+
+    def _grow(self):
+        for name in ('_course', '_learner', '_complete', '_success',
+                     '_score', '_time'):
+            column = getattr(self, name)
+            grown = numpy.zeros(max(len(column) * 2, 1), column.dtype)
+            grown[:len(column)] = column
+            setattr(self, name, grown)
+
+    @staticmethod
+    def _get_index(indexes, ids, key):
+        index = indexes.get(key)
+        if index is None:
+            index = len(ids)
+            indexes[key] = index
+            ids.append(key)
+        return index
+
+    @staticmethod
+    def _to_float(value):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return numpy.nan
+
+    @staticmethod
+    def _to_stat(value):
+        if numpy.isnan(value):
+            return None
+        return float(value)
+
+
+class EndpointRouter(object):
+    """
+    Routes web service calls across the service URLs of the configuration.
+    Each call goes to the healthy endpoint with the lowest round-trip time,
+    and fails over to the next endpoint if the endpoint cannot be reached
+    or does not answer in time.
+    Calls to the read-only methods in idempotent_methods also fail over if
+    the endpoint fails after the request was sent, such as with a server
+    error or a dropped response; other calls are not sent again, since the
+    first endpoint may already have acted on them. Round-trip times are
+    measured from the calls themselves and from pings sent by a background
+    prober. Set the router as the router attribute of a ScormCloudService
+    to route its calls; calls made with an explicit serviceurl are not
+    routed.
+    """
+
+    IDEMPOTENT_METHODS = frozenset([
+        'rustici.debug.ping',
+        'rustici.debug.authPing',
+        'rustici.course.getAssets',
+        'rustici.course.getAttributes',
+        'rustici.course.getCourseList',
+        'rustici.course.getMetadata',
+        'rustici.registration.getLaunchHistory',
+        'rustici.registration.getLaunchInfo',
+        'rustici.registration.getRegistrationList',
+        'rustici.registration.getRegistrationResult',
+    ])
+
+    def __init__(self, service, endpoints=None, probe_interval=30,
+                 authenticated=False, smoothing=0.3, idempotent_methods=None):
+        """
+        Arguments:
+        service -- the ScormCloudService whose calls are routed
+        endpoints -- (optional) the list of service URLs. Defaults to the
+            serviceurls of the service's configuration
+        probe_interval -- the number of seconds between probes; also the
+            time after which a failed endpoint is tried again
+        authenticated -- if True, probes use authping instead of ping
+        smoothing -- the weight of each new round-trip time sample
+        idempotent_methods -- (optional) the web service methods that are
+            safe to send again. Defaults to IDEMPOTENT_METHODS
+        """
+        self.service = service
+        if endpoints is None:
+            endpoints = service.config.serviceurls
+        self.endpoints = list(endpoints)
+        self.probe_interval = probe_interval
+        self.authenticated = authenticated
+        self.smoothing = smoothing
+        if idempotent_methods is None:
+            idempotent_methods = self.IDEMPOTENT_METHODS
+        self.idempotent_methods = frozenset(idempotent_methods)
+        self.failovers = 0
+        self._stats = dict([(url, _EndpointStats()) for url in self.endpoints])
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Starts probing the endpoints in a background thread.
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the background prober.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def probe(self):
+        """
+        Pings every endpoint once, updating its round-trip time and health.
+        """
+        debug = self.service.get_debug_service()
+        for url in self.endpoints:
+            start = time.time()
+            if self.authenticated:
+                ok = debug.authping(url)
+            else:
+                ok = debug.ping(url)
+            self._lock.acquire()
+            try:
+                stats = self._stats[url]
+                stats.probes += 1
+                if ok:
+                    stats.record_rtt(time.time() - start, self.smoothing)
+                else:
+                    stats.mark_failed()
+            finally:
+                self._lock.release()
+
+    def choose(self, exclude=()):
+        """
+        Returns the endpoint to send the next call to, or None if every
+        endpoint is excluded. Endpoints that failed recently are only
+        chosen if no other endpoint is left.
+
+        Arguments:
+        exclude -- the endpoints already tried for this call
+        """
+        now = time.time()
+        self._lock.acquire()
+        try:
+            candidates = []
+            for (position, url) in enumerate(self.endpoints):
+                if url in exclude:
+                    continue
+                stats = self._stats[url]
+                unhealthy = (not stats.healthy and
+                             now - stats.failed_at < self.probe_interval)
+                rtt = stats.rtt
+                if rtt is None:
+                    rtt = float('inf')
+                candidates.append((unhealthy, rtt, position, url))
+            if not candidates:
+                return None
+            url = min(candidates)[3]
+            if exclude:
+                self.failovers += 1
+            self._stats[url].routed += 1
+            return url
+        finally:
+            self._lock.release()
+
+    def report_success(self, url, latency):
+        """
+        Records a successful call to the endpoint.
+
+        Arguments:
+        url -- the endpoint
+        latency -- the duration of the call, in seconds
+        """
+        self._lock.acquire()
+        try:
+            self._stats[url].record_rtt(latency, self.smoothing)
+        finally:
+            self._lock.release()
+
+    def report_failure(self, url):
+        """
+        Records that the endpoint could not serve a call and marks it as
+        unhealthy.
+
+        Arguments:
+        url -- the endpoint
+        """
+        self._lock.acquire()
+        try:
+            self._stats[url].mark_failed()
+        finally:
+            self._lock.release()
+
+    def get_metrics(self):
+        """
+        Returns a dictionary with the number of failovers and, for each
+        endpoint, its health, smoothed round-trip time and the number of
+        calls routed to it, failures and probes.
+        """
+        self._lock.acquire()
+        try:
+            endpoints = {}
+            for (url, stats) in self._stats.iteritems():
+                endpoints[url] = {'healthy': stats.healthy,
+                                  'rtt': stats.rtt,
+                                  'routed': stats.routed,
+                                  'failures': stats.failures,
+                                  'probes': stats.probes}
+            return {'failovers': self.failovers, 'endpoints': endpoints}
+        finally:
+            self._lock.release()
+
+    @staticmethod
+    def is_endpoint_failure(ex):
+        """
+        Returns True if the exception shows that the endpoint could not
+        serve the call in time or at all, as opposed to an error in the call
+        itself.
+
+        Arguments:
+        ex -- the exception raised while sending the call
+        """
+        if isinstance(ex, ScormCloudTimeoutError):
+            return ex.phase is not None
+        if isinstance(ex, urllib2.HTTPError):
+            return ex.code >= 500
+        return isinstance(ex, (urllib2.URLError, socket.error,
+                               httplib.HTTPException))
+
+    def can_fail_over(self, method, ex):
+        """
+        Returns True if the call may be sent to another endpoint after the
+        endpoint failure ex: always for the idempotent methods, and
+        otherwise only if the request was never sent, i.e. urllib2 could not
+        connect or send it, or timed out doing so.
+
+        Arguments:
+        method -- the full name of the web service method
+        ex -- the endpoint failure raised while sending the call
+        """
+        if method in self.idempotent_methods:
+            return True
+        if isinstance(ex, ScormCloudTimeoutError):
+            return ex.phase == 'connect'
+        return (isinstance(ex, urllib2.URLError) and
+                not isinstance(ex, urllib2.HTTPError))
+
+    def _run(self):
+        while not self._stop.isSet():
+            try:
+                self.probe()
+            except Exception, ex:
+                logging.warning('probing endpoints failed: %s' % ex)
+            self._stop.wait(self.probe_interval)
+
+
+class _EndpointStats(object):
+    def __init__(self):
+        self.healthy = True
+        self.failed_at = 0
+        self.rtt = None
+        self.routed = 0
+        self.failures = 0
+        self.probes = 0
+
+    def record_rtt(self, rtt, smoothing):
+        self.healthy = True
+        if self.rtt is None:
+            self.rtt = rtt
+        else:
+            self.rtt += smoothing * (rtt - self.rtt)
+
+    def mark_failed(self):
+        self.healthy = False
+        self.failed_at = time.time()
+        self.failures += 1
+
+
+class UrllibTransport(object):
+    """
+    Default transport that sends web service requests with urllib2.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def send(self, url, postparams, headers=None, timeout=None):
+        """
+        Sends the request and returns the raw response string. With a
+        timeout, the socket timeout bounds the connect and each blocking
+        socket operation, and the connection is shut down if the response
+        has not been read in full when the time is up.
+
+        Arguments:
+        url -- the full URL of the request, including parameters
+        postparams -- the POST body, as a string or a file object, or None
+            for a GET request
+        headers -- (optional) a dictionary of extra request headers
+        timeout -- (optional) the time budget for the request, in seconds
+        """
+        return self._request(url, postparams, headers, timeout, None)
+
+    def send_to_file(self, url, postparams, fileobj, headers=None,
+                     timeout=None):
+        """
+        Sends the request like send, but writes the response to the file
+        object in chunks of CHUNK_SIZE bytes instead of returning it.
+
+        Arguments:
+        url -- the full URL of the request, including parameters
+        postparams -- the POST body, as a string or a file object, or None
+            for a GET request
+        fileobj -- the file object to write the response to
+        headers -- (optional) a dictionary of extra request headers
+        timeout -- (optional) the time budget for the request, in seconds
+        """
+        self._request(url, postparams, headers, timeout, fileobj)
+
+    def _request(self, url, postparams, headers, timeout, fileobj):
+        request = urllib2.Request(url, postparams, headers or {})
+        try:
+            if timeout is None:
+                cloudsocket = urllib2.urlopen(request)
+            else:
+                end = time.time() + timeout
+                cloudsocket = urllib2.urlopen(request, timeout=timeout)
+        except urllib2.URLError, ex:
+            # urllib2 wraps the errors raised while connecting and sending
+            # the request; errors waiting for the response pass through.
+            if isinstance(ex.reason, socket.timeout):
+                raise ScormCloudTimeoutError('Timed out waiting for %s' %
+                                             url, 'connect')
+            raise
+        except socket.timeout:
+            raise ScormCloudTimeoutError('Timed out waiting for %s' % url,
+                                         'response')
+        aborted = threading.Event()
+        timer = None
+        if timeout is not None:
+            sock = self._get_socket(cloudsocket)
+            if sock is not None:
+                timer = threading.Timer(max(end - time.time(), 0),
+                                        self._abort, [sock, aborted])
+                timer.setDaemon(True)
+                timer.start()
+        try:
+            try:
+                if fileobj is None:
+                    reply = cloudsocket.read()
+                else:
+                    reply = None
+                    while True:
+                        chunk = cloudsocket.read(self.CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        fileobj.write(chunk)
+            except Exception, ex:
+                if aborted.isSet() or isinstance(ex, socket.timeout):
+                    raise ScormCloudTimeoutError('Timed out reading from %s' %
+                                                 url, 'response')
+                raise
+            if aborted.isSet():
+                raise ScormCloudTimeoutError('Timed out reading from %s' %
+                                             url, 'response')
+            return reply
+        finally:
+            if timer is not None:
+                timer.cancel()
+            cloudsocket.close()
+
+    @staticmethod
+    def _get_socket(cloudsocket):
+        # urllib2 wraps the httplib response in a socket._fileobject, and the
+        # response reads from a file object made from the connection socket.
+        try:
+            return cloudsocket.fp._sock.fp._sock
+        except AttributeError:
+            return None
+
+    @staticmethod
+    def _abort(sock, aborted):
+        aborted.set()
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+
+
+class CassetteTransport(object):
+    """
+    Transport that records requests and responses to a gzipped cassette file
+    and replays them later without contacting the SCORM Cloud. Requests are
+    matched on the URL path and parameters, ignoring the ts and sig
+    parameters that change with every call. Repeated identical requests are
+    answered with the recorded responses in order, starting over once they
+    have all been used.
+    """
+
+    IGNORED_PARAMETERS = ('ts', 'sig')
+
+    def __init__(self, path, mode='replay', transport=None, speed=None):
+        """
+        Arguments:
+        path -- the cassette file
+        mode -- "record" to send requests through transport and record them,
+            or "replay" to answer requests from the cassette
+        transport -- (optional) the transport used when recording. Defaults
+            to UrllibTransport
+        speed -- (optional) when replaying, the factor by which the recorded
+            response times are sped up; 1.0 replays at recorded speed. If
+            None, responses are returned without delay
+        """
+        self.path = path
+        self.mode = mode
+        self.transport = transport
+        if self.transport is None:
+            self.transport = UrllibTransport()
+        self.speed = speed
+        self._lock = threading.Lock()
+        self._recorded = {}
+        self._file = None
+        if mode == 'record':
+            self._file = gzip.open(path, 'wb')
+        elif mode == 'replay':
+            self._load()
+        else:
+            raise ValueError('Unknown cassette mode: %s' % mode)
+
+    def send(self, url, postparams, headers=None, timeout=None):
+        """
+        Sends or replays the request and returns the raw response string.
+
+        Arguments:
+        url -- the full URL of the request, including parameters
+        postparams -- the POST body, as a string or a file object, or None
+            for a GET request
+        headers -- (optional) a dictionary of extra request headers
+        timeout -- (optional) the time budget for the request, in seconds
+        """
+        key = self.get_key(url, postparams)
+        if self.mode == 'record':
+            start = time.time()
+            reply = self.transport.send(url, postparams, headers, timeout)
+            entry = {'key': key, 'elapsed': time.time() - start,
+                     'response': base64.b64encode(reply)}
+            self._lock.acquire()
+            try:
+                self._file.write(json.dumps(entry) + '\n')
+                self._file.flush()
+            finally:
+                self._lock.release()
+            return reply
+
+        self._lock.acquire()
+        try:
+            entries = self._recorded.get(key)
+            if not entries:
+                raise ScormCloudError('No recorded response for %s' % key)
+            entry = entries.popleft()
+            entries.append(entry)
+        finally:
+            self._lock.release()
+        if self.speed:
+            delay = entry['elapsed'] / self.speed
+            if timeout is not None and delay > timeout:
+                time.sleep(timeout)
+                raise ScormCloudTimeoutError('Timed out replaying %s' % key,
+                                             'response')
+            time.sleep(delay)
+        return base64.b64decode(entry['response'])
+
+    def close(self):
+        """
+        Closes the cassette file when recording.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    @classmethod
+    def get_key(cls, url, postparams=None):
+        """
+        Returns the key used to match a request against the cassette.
+
+        Arguments:
+        url -- the full URL of the request, including parameters
+        postparams -- the POST body, as a string or a file object, or None
+            for a GET request
+        """
+        parts = urlparse.urlsplit(url)
+        params = [(k, v) for (k, v) in urlparse.parse_qsl(parts.query, True)
+                  if k not in cls.IGNORED_PARAMETERS]
+        key = parts.path + '?' + urllib.urlencode(sorted(params))
+        if hasattr(postparams, 'read'):
+            digest = md5()
+            postparams.seek(0)
+            while True:
+                chunk = postparams.read(65536)
+                if not chunk:
+                    break
+                digest.update(chunk)
+            postparams.seek(0)
+            key += '#' + digest.hexdigest()
+        elif postparams is not None:
+            key += '#' + md5(postparams).hexdigest()
+        return key
+
+    def _load(self):
+        cassette = gzip.open(self.path, 'rb')
+        try:
+            for line in cassette:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                key = entry['key'].encode('utf-8')
+                self._recorded.setdefault(key, deque()).append(entry)
+        finally:
+            cassette.close()
+
+
 class ScormCloudUtilities(object):
     """
     Provides utility functions for working with the SCORM Cloud.
@@ -993,6 +4246,46 @@ class ScormCloudUtilities(object):
         ver = versionpattern.sub('', version.lower())
         return "%s.%s.%s" % (org, app, ver)
 
+    @staticmethod
+    def send_postback(url, resultxml, authtype='form', username=None,
+                      password=None, timeout=None):
+        """
+        Posts registration results to a postback URL the way the SCORM Cloud
+        does, for testing a postback receiver locally. Returns the HTTP
+        status code of the response.
+
+        Arguments:
+        url -- the postback URL
+        resultxml -- the registrationreport XML to post
+        authtype -- "form" to send the credentials as form fields, or
+            "httpbasic" to send them as HTTP basic auth
+        username -- (optional) the user name to send
+        password -- (optional) the password to send
+        timeout -- (optional) the socket timeout, in seconds
+        """
+        fields = {'data': resultxml}
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        if username is not None or password is not None:
+            if authtype == 'httpbasic':
+                headers['Authorization'] = 'Basic ' + base64.b64encode(
+                    '%s:%s' % (username, password))
+            else:
+                fields['username'] = username or ''
+                fields['password'] = password or ''
+        request = urllib2.Request(url, urllib.urlencode(make_utf8(fields)),
+                                  headers)
+        try:
+            if timeout is None:
+                response = urllib2.urlopen(request)
+            else:
+                response = urllib2.urlopen(request, timeout=timeout)
+        except urllib2.HTTPError, ex:
+            return ex.code
+        try:
+            return response.getcode()
+        finally:
+            response.close()
+
     @staticmethod
     def clean_cloud_host_url(url):
         """